@@ -0,0 +1,77 @@
+import logging
+import time
+from api import coinapi
+from api.settings import ASSET_LIST_MIN_SHARE, ASSET_LIST_RELOAD_INTERVAL
+from .models import Alert, Asset
+
+logger = logging.getLogger(__name__)
+
+_asset_ids = frozenset()
+_loaded_at = None
+
+
+def fetch_asset_list():
+    """
+    This function returns the list of all assets where a USD exchange rate
+    is provided by the coinapi.io API
+    """
+    max_length = Asset._meta.get_field("asset_id").max_length
+    with coinapi.get("assets", stream=True) as response:
+        return [
+            asset_id
+            for asset_id, _ in coinapi.iter_prices(response)
+            if len(asset_id) <= max_length
+        ]
+
+
+def refresh_assets():
+    """
+    Replaces the stored catalogue by the one currently served by coinapi.io,
+    only adding the new assets if it looks truncated
+    """
+    global _loaded_at
+    asset_ids = set(fetch_asset_list())
+    stored = Asset.objects.count()
+    if asset_ids and len(asset_ids) >= stored * ASSET_LIST_MIN_SHARE:
+        Asset.objects.exclude(asset_id__in=asset_ids).delete()
+    else:
+        logger.warning(
+            "Kept the %s stored assets, coinapi.io only listed %s of them",
+            stored,
+            len(asset_ids),
+        )
+    Asset.objects.bulk_create(
+        [Asset(asset_id=asset_id) for asset_id in asset_ids], ignore_conflicts=True
+    )
+    _loaded_at = None
+    return len(asset_ids)
+
+
+def get_asset_ids():
+    """
+    The user can pick any two currencies from this set to create his alerts.
+    It is lazily loaded from the database and reloaded every
+    ASSET_LIST_RELOAD_INTERVAL seconds (or until it is filled), so nothing is
+    downloaded at import time
+    """
+    global _asset_ids, _loaded_at
+    if (
+        not _asset_ids
+        or _loaded_at is None
+        or time.time() - _loaded_at > ASSET_LIST_RELOAD_INTERVAL
+    ):
+        _asset_ids = frozenset(Asset.objects.values_list("asset_id", flat=True))
+        _loaded_at = time.time()
+    return _asset_ids
+
+
+def get_alert_assets():
+    """Returns the set of the assets used by the active alerts"""
+    assets = set()
+    for pair in (
+        Alert.objects.filter(is_active=True)
+        .values_list("base_currency", "quote_currency")
+        .distinct()
+    ):
+        assets.update(pair)
+    return frozenset(assets)
@@ -0,0 +1,100 @@
+from django.db import transaction
+from django.utils import timezone
+from .models import Alert
+from . import timers
+
+
+class AlertChanges:
+    """
+    State transitions of the alerts collected during a check, flushed at its
+    end with a few set based queries touching only the changed columns, so
+    the database load follows the number of transitions instead of the
+    number of alerts
+    """
+
+    def __init__(self):
+        self.deactivated = set()
+        self.windows = {}
+        self.checks = {}
+
+    def __len__(self):
+        return len(self.deactivated) + len(self.windows) + len(self.checks)
+
+    def deactivate(self, alert_ids):
+        self.deactivated.update(alert_ids)
+
+    def start_window(self, alert_id, starting_value, period_start, next_check_at):
+        """Records a new starting value (and period start) for the alert"""
+        self.windows[alert_id] = (starting_value, period_start, next_check_at)
+
+    def schedule(self, alert_ids, next_check_at):
+        """
+        Records when the checker has to come back to the alerts, None putting
+        them back on every tick
+        """
+        for alert_id in alert_ids:
+            self.checks[alert_id] = next_check_at
+
+    def flush(self):
+        """
+        Writes the changes and returns the ids of the alerts that were
+        actually deactivated by this flush, i.e. that were still active, so
+        concurrent or repeated checks trigger an alert only once. The trigger
+        time identifies the trigger for its notification.
+        """
+        now = timezone.now()
+        deactivated = []
+        if self.deactivated:
+            with transaction.atomic():
+                deactivated = list(
+                    Alert.objects.select_for_update()
+                    .filter(id__in=self.deactivated, is_active=True)
+                    .values_list("id", flat=True)
+                )
+                Alert.objects.filter(id__in=deactivated, is_active=True).update(
+                    is_active=False, triggered_at=now, modified=now
+                )
+        windows = [
+            Alert(
+                id=alert_id,
+                starting_value_in_quote=starting_value,
+                period_start=period_start,
+                next_check_at=next_check_at,
+                modified=now,
+            )
+            for alert_id, (
+                starting_value,
+                period_start,
+                next_check_at,
+            ) in self.windows.items()
+            if alert_id not in self.deactivated
+        ]
+        Alert.objects.bulk_update(
+            windows,
+            ["starting_value_in_quote", "period_start", "next_check_at", "modified"],
+            batch_size=1000,
+        )
+        checks = {
+            alert_id: next_check_at
+            for alert_id, next_check_at in self.checks.items()
+            if alert_id not in self.deactivated and alert_id not in self.windows
+        }
+        Alert.objects.bulk_update(
+            [
+                Alert(id=alert_id, next_check_at=next_check_at, modified=now)
+                for alert_id, next_check_at in checks.items()
+            ],
+            ["next_check_at", "modified"],
+            batch_size=1000,
+        )
+        timers.schedule(
+            {
+                alert_id: next_check_at
+                for alert_id, next_check_at in checks.items()
+                if next_check_at is not None
+            }
+        )
+        self.deactivated = set()
+        self.windows = {}
+        self.checks = {}
+        return deactivated
@@ -0,0 +1,251 @@
+from datetime import datetime, timedelta
+import numpy as np
+from django.utils import timezone
+from api.settings import ALERT_CHECK_INTERVAL
+from .history import get_rate_history
+from .mirror import AlertMirror
+from .windows import RollingWindow
+
+
+class EvolutionTable(AlertMirror):
+    """
+    Column arrays of the active evolution alerts, so a whole price snapshot
+    is checked against all of them in a few array operations instead of
+    one Decimal computation per alert. Alerts sharing a pair and a period
+    share a rolling window, warmed up from the price history when it is
+    created, and alerts sharing a pair, an evolution rate and a period share
+    a single row once they are older than their period. Younger alerts get
+    the extremes recorded since their period start when they are loaded.
+    Rows whose members all left the table are only flagged as dead until the
+    next rebuild.
+    The windows only see the rates of the ticks evaluated by this process, a
+    table left behind for a few ticks catches up from the history.
+    """
+
+    fields = (
+        "id",
+        "base_currency",
+        "quote_currency",
+        "evolution_rate",
+        "period",
+        "period_start",
+        "starting_value_in_quote",
+        "is_active",
+    )
+    filters = {"period__isnull": False}
+
+    def reset(self):
+        self.evaluated_at = None
+        self.pairs = []
+        self.pair_rows = {}
+        self.windows = []
+        self.window_pairs = []
+        self.window_rows = {}
+        self.rows = {}
+        self.members = []
+        self.group_rows = {}
+        self.pair = np.empty(0, dtype=np.int64)
+        self.window = np.empty(0, dtype=np.int64)
+        self.factor = np.empty(0)
+        self.since = np.empty(0)
+        self.length = np.empty(0)
+        self.low = np.empty(0)
+        self.high = np.empty(0)
+        self.upward = np.empty(0, dtype=bool)
+        self.live = np.empty(0, dtype=bool)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get_pair(self, base_currency, quote_currency):
+        pair = (base_currency, quote_currency)
+        if pair not in self.pair_rows:
+            self.pair_rows[pair] = len(self.pairs)
+            self.pairs.append(pair)
+        return self.pair_rows[pair]
+
+    def get_window(self, pair, length):
+        """Returns the rolling window of the pair over length seconds"""
+        if (pair, length) not in self.window_rows:
+            self.window_rows[(pair, length)] = len(self.windows)
+            self.windows.append(RollingWindow(length))
+            self.window_pairs.append(pair)
+        return self.window_rows[(pair, length)]
+
+    def warm_up(self, windows):
+        """Fills new windows from the price history, one query per pair"""
+        now = timezone.now()
+        by_pair = {}
+        for window in windows:
+            by_pair.setdefault(self.window_pairs[window], []).append(window)
+        for pair, pair_windows in by_pair.items():
+            length = max(self.windows[window].length for window in pair_windows)
+            history = get_rate_history(
+                *self.pairs[pair], now - timedelta(seconds=length), now
+            )
+            for time, rate in history:
+                for window in pair_windows:
+                    self.windows[window].push(time.timestamp(), rate)
+
+    def warm_up_rows(self, rows):
+        """
+        Fills the extremes of new young rows with the rates recorded in the
+        history since their period start, one query per pair
+        """
+        end = timezone.now()
+        by_pair = {}
+        for row in rows:
+            by_pair.setdefault(self.pair[row], []).append(row)
+        for pair, pair_rows in by_pair.items():
+            pair_rows = np.array(pair_rows)
+            start = datetime.fromtimestamp(self.since[pair_rows].min(), timezone.utc)
+            history = get_rate_history(*self.pairs[pair], start, end)
+            for time, rate in history:
+                started = pair_rows[self.since[pair_rows] <= time.timestamp()]
+                self.low[started] = np.fmin(self.low[started], rate)
+                self.high[started] = np.fmax(self.high[started], rate)
+
+    def discard(self, alert_id):
+        row = self.rows.pop(alert_id, None)
+        if row is None:
+            return
+        self.members[row].discard(alert_id)
+        if not self.members[row]:
+            self.live[row] = False
+
+    def load(self, rows):
+        now = timezone.now().timestamp()
+        columns = {
+            "pair": [],
+            "window": [],
+            "factor": [],
+            "since": [],
+            "length": [],
+            "low": [],
+            "high": [],
+            "upward": [],
+        }
+        windows = len(self.windows)
+        young_rows = []
+        for (
+            alert_id,
+            base_currency,
+            quote_currency,
+            evolution_rate,
+            period,
+            period_start,
+            starting_value,
+            is_active,
+        ) in rows:
+            self.discard(alert_id)
+            if not is_active or starting_value is None:
+                continue
+            pair = self.get_pair(base_currency, quote_currency)
+            if now - period_start.timestamp() < period.total_seconds():
+                group = alert_id
+            else:
+                group = (pair, evolution_rate, period)
+            row = self.group_rows.get(group)
+            if row is not None and self.members[row]:
+                self.members[row].add(alert_id)
+                self.rows[alert_id] = row
+                continue
+            if group == alert_id:
+                young_rows.append(len(self.members))
+            self.group_rows[group] = len(self.members)
+            self.members.append({alert_id})
+            self.rows[alert_id] = len(self.members) - 1
+            columns["pair"].append(pair)
+            columns["window"].append(self.get_window(pair, period.total_seconds()))
+            columns["factor"].append(1 + float(evolution_rate) / 100)
+            columns["since"].append(period_start.timestamp())
+            columns["length"].append(period.total_seconds())
+            columns["low"].append(float(starting_value))
+            columns["high"].append(float(starting_value))
+            columns["upward"].append(evolution_rate >= 0)
+        self.warm_up(range(windows, len(self.windows)))
+        columns["live"] = [True] * len(columns["pair"])
+        for name, values in columns.items():
+            column = getattr(self, name)
+            values = np.array(values, dtype=column.dtype)
+            setattr(self, name, np.concatenate([column, values]))
+        self.warm_up_rows(young_rows)
+
+    def catch_up(self, now):
+        """
+        Feeds the windows and the extremes of the young rows with the rates
+        recorded in the history since the last evaluation, one query per pair
+        """
+        start = datetime.fromtimestamp(self.evaluated_at, timezone.utc)
+        end = datetime.fromtimestamp(now, timezone.utc)
+        for pair, (base_currency, quote_currency) in enumerate(self.pairs):
+            history = get_rate_history(base_currency, quote_currency, start, end)
+            windows = [
+                window
+                for window, window_pair in zip(self.windows, self.window_pairs)
+                if window_pair == pair
+            ]
+            rows = self.live & (self.pair == pair)
+            for time, rate in history:
+                time = time.timestamp()
+                for window in windows:
+                    window.push(time, rate)
+                started = rows & (self.since <= time)
+                self.low[started] = np.fmin(self.low[started], rate)
+                self.high[started] = np.fmax(self.high[started], rate)
+        self.evaluated_at = now
+
+    def evaluate(self, engine, now):
+        """
+        Checks the whole table against the rates at time now (a POSIX
+        timestamp) and returns the ids of the triggered alerts, which leave
+        the table with their whole group. An alert is met when the rate moved
+        by its evolution rate from the lowest (or highest) rate of its rolling
+        window, alerts younger than their period only considering the rates
+        seen since their starting value.
+        """
+        self.evaluated_at = now
+        pair_rates = engine.rates_of(self.pairs)
+        for window, pair in zip(self.windows, self.window_pairs):
+            if not np.isnan(pair_rates[pair]):
+                window.push(now, pair_rates[pair])
+        lows = np.array([window.low for window in self.windows], float)
+        highs = np.array([window.high for window in self.windows], float)
+        rates = pair_rates[self.pair]
+        checked = self.live & ~np.isnan(rates)
+        self.low = np.fmin(self.low, rates)
+        self.high = np.fmax(self.high, rates)
+        young = now - self.since < self.length
+        low = np.where(young, self.low, lows[self.window])
+        high = np.where(young, self.high, highs[self.window])
+        target = np.where(self.upward, low, high) * self.factor
+        met = np.where(self.upward, rates > target, rates <= target)
+        triggered = []
+        for row in np.flatnonzero(checked & met):
+            triggered += self.members[row]
+            self.members[row] = set()
+            self.live[row] = False
+        for alert_id in triggered:
+            del self.rows[alert_id]
+        return triggered
+
+
+_tables = {}
+
+
+def get_evolution_table(shard=None):
+    """
+    Returns the table of the shard (of all the alerts if None) kept by this
+    process, synced with the database and caught up with the ticks it missed
+    """
+    if shard not in _tables:
+        _tables[shard] = EvolutionTable(shard)
+    table = _tables[shard]
+    now = timezone.now().timestamp()
+    if (
+        table.evaluated_at is not None
+        and now - table.evaluated_at > 2 * ALERT_CHECK_INTERVAL
+    ):
+        table.catch_up(now)
+    table.sync()
+    return table
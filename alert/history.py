@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+from django.db import transaction
+from django.db.models import Avg
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from api.settings import (
+    PRICE_HISTORY_DOWNSAMPLING,
+    PRICE_HISTORY_INTERVAL,
+    PRICE_HISTORY_RAW_RETENTION,
+    PRICE_HISTORY_RETENTION,
+)
+from .models import PriceSample
+
+RESOLUTIONS = {"minute": 60, "hour": 60 * 60, "day": 24 * 60 * 60}
+
+_recorded_at = 0
+
+
+def record_snapshot(snapshot, assets):
+    """
+    Appends the prices of the given assets to the history, at most once
+    every PRICE_HISTORY_INTERVAL seconds per process
+    """
+    global _recorded_at
+    if snapshot.fetched_at - _recorded_at < PRICE_HISTORY_INTERVAL:
+        return
+    time = datetime.fromtimestamp(snapshot.fetched_at, timezone.utc)
+    PriceSample.objects.bulk_create(
+        [
+            PriceSample(asset_id=asset_id, time=time, price=snapshot.prices[asset_id])
+            for asset_id in assets
+            if asset_id in snapshot
+        ],
+        ignore_conflicts=True,
+    )
+    _recorded_at = snapshot.fetched_at
+
+
+def get_rate_history(base_currency, quote_currency, start, end):
+    """
+    Returns the (time, rate) samples of base_currency expressed in
+    quote_currency between start and end, read from the history only
+    """
+    samples = PriceSample.objects.filter(
+        asset_id__in=[base_currency, quote_currency], time__gte=start, time__lte=end
+    ).values_list("time", "resolution", "asset_id", "price")
+    prices = {}
+    for time, resolution, asset_id, price in samples.iterator():
+        prices.setdefault((time, resolution), {})[asset_id] = price
+    return [
+        (time, pair_prices[base_currency] / pair_prices[quote_currency])
+        for (time, _), pair_prices in sorted(prices.items())
+        if base_currency in pair_prices and quote_currency in pair_prices
+    ]
+
+
+def compact_history(now=None):
+    """
+    Applies the retention policy: raw samples older than
+    PRICE_HISTORY_RAW_RETENTION seconds are averaged by
+    PRICE_HISTORY_DOWNSAMPLING period and every sample older than
+    PRICE_HISTORY_RETENTION seconds is deleted
+    """
+    now = now or timezone.now()
+    resolution = RESOLUTIONS[PRICE_HISTORY_DOWNSAMPLING]
+    cutoff = now - timedelta(seconds=PRICE_HISTORY_RAW_RETENTION)
+    cutoff -= timedelta(seconds=cutoff.timestamp() % resolution)
+    raw = PriceSample.objects.filter(resolution=0, time__lt=cutoff)
+    buckets = (
+        raw.order_by()
+        .annotate(bucket=Trunc("time", PRICE_HISTORY_DOWNSAMPLING))
+        .values("asset_id", "bucket")
+        .annotate(average=Avg("price"))
+    )
+    with transaction.atomic():
+        PriceSample.objects.bulk_create(
+            [
+                PriceSample(
+                    asset_id=bucket["asset_id"],
+                    time=bucket["bucket"],
+                    price=bucket["average"],
+                    resolution=resolution,
+                )
+                for bucket in buckets.iterator()
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        raw.delete()
+    PriceSample.objects.filter(
+        time__lt=now - timedelta(seconds=PRICE_HISTORY_RETENTION)
+    ).delete()
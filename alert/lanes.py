@@ -0,0 +1,102 @@
+import math
+from datetime import timedelta
+from api.settings import (
+    ALERT_CHECK_INTERVAL,
+    ALERT_LANE_REVIEW_INTERVAL,
+    ALERT_LANE_SIGMAS,
+    ALERT_SLOW_LANE_MAX_DELAY,
+    ALERT_VOLATILITY_WINDOW,
+)
+from .history import get_rate_history
+
+_volatilities = {}
+
+
+def get_volatility(pair, now):
+    """
+    Returns the volatility of the pair, i.e. the standard deviation of its
+    log returns over one second, estimated from the history of the last
+    ALERT_VOLATILITY_WINDOW seconds (None without enough samples) and cached
+    for ALERT_LANE_REVIEW_INTERVAL seconds
+    """
+    review = timedelta(seconds=ALERT_LANE_REVIEW_INTERVAL)
+    if pair in _volatilities and now - _volatilities[pair][0] < review:
+        return _volatilities[pair][1]
+    history = get_rate_history(
+        *pair, now - timedelta(seconds=ALERT_VOLATILITY_WINDOW), now
+    )
+    variances = [
+        math.log(rate / previous_rate) ** 2 / (time - previous_time).total_seconds()
+        for (previous_time, previous_rate), (time, rate) in zip(history, history[1:])
+        if time > previous_time and rate > 0 and previous_rate > 0
+    ]
+    volatility = None
+    if variances:
+        volatility = math.sqrt(sum(variances) / len(variances))
+    _volatilities[pair] = (now, volatility)
+    return volatility
+
+
+def get_check_delay(rate, threshold, volatility):
+    """
+    Returns how many seconds the rate needs to plausibly reach threshold,
+    i.e. to move by ALERT_LANE_SIGMAS standard deviations, capped at
+    ALERT_SLOW_LANE_MAX_DELAY. It is 0 for the alerts that belong to the fast
+    lane: the ones that could trigger within the next ticks and the ones
+    whose volatility is unknown.
+    """
+    if volatility is None or rate <= 0 or threshold <= 0:
+        return 0
+    distance = abs(math.log(threshold / rate))
+    if volatility == 0:
+        return ALERT_SLOW_LANE_MAX_DELAY if distance else 0
+    delay = (distance / (ALERT_LANE_SIGMAS * volatility)) ** 2
+    if delay < 2 * ALERT_CHECK_INTERVAL:
+        return 0
+    return min(delay, ALERT_SLOW_LANE_MAX_DELAY)
+
+
+def review_lanes(index, engine, changes, now):
+    """
+    Moves the threshold alerts too far from their threshold to the slow
+    lane every ALERT_LANE_REVIEW_INTERVAL seconds: they leave the index and
+    are scheduled (see alert.timers) for when they could get close to it
+    """
+    if (
+        index.reviewed_at is not None
+        and (now - index.reviewed_at).total_seconds() < ALERT_LANE_REVIEW_INTERVAL
+    ):
+        return
+    index.reviewed_at = now
+    for pair, thresholds in list(index.pairs.items()):
+        if pair not in engine:
+            continue
+        rate = engine.rate(*pair)
+        volatility = get_volatility(pair, now)
+        for (threshold, _), members in list(thresholds.groups.items()):
+            delay = get_check_delay(rate, threshold, volatility)
+            if not delay:
+                continue
+            alert_ids = list(members)
+            for alert_id in alert_ids:
+                index.discard(alert_id)
+            changes.schedule(alert_ids, now + timedelta(seconds=delay))
+
+
+def check_slow_lane_alert(
+    alert_id, pair, threshold, starting_value, engine, changes, now
+):
+    """
+    Checks a due slow lane alert against the rates: it is triggered if met,
+    otherwise scheduled again or moved back to the fast lane (the index)
+    """
+    rate = engine.rate(*pair)
+    if threshold >= starting_value:
+        met = rate > threshold
+    else:
+        met = rate < threshold
+    if met:
+        changes.deactivate([alert_id])
+        return
+    delay = get_check_delay(rate, threshold, get_volatility(pair, now))
+    changes.schedule([alert_id], now + timedelta(seconds=delay) if delay else None)
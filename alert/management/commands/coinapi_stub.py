@@ -0,0 +1,49 @@
+import threading
+from django.core.management.base import BaseCommand
+from api.stub import PriceReplay, serve_http, serve_websocket
+
+
+class Command(BaseCommand):
+    help = (
+        "Serves replayed or synthetic prices on a local stand-in of the "
+        "coinapi.io /v1/assets endpoint (and optionally of its websocket). "
+        "Point COINAPI_URL and COINAPI_WS_URL to it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8001)
+        parser.add_argument(
+            "--ws-port", type=int, help="Also stream the prices on this port"
+        )
+        parser.add_argument(
+            "--replay", help="JSON lines file of recorded price frames to replay"
+        )
+        parser.add_argument(
+            "--assets", type=int, default=50, help="Number of synthetic assets"
+        )
+        parser.add_argument(
+            "--speed", type=float, default=1.0, help="Replay speed multiplier"
+        )
+        parser.add_argument(
+            "--volatility",
+            type=float,
+            default=0.01,
+            help="Standard deviation of the synthetic log returns per second",
+        )
+        parser.add_argument("--seed", type=int)
+
+    def handle(self, *args, **options):
+        replay = PriceReplay(
+            path=options["replay"],
+            assets=options["assets"],
+            speed=options["speed"],
+            volatility=options["volatility"],
+            seed=options["seed"],
+        )
+        if options["ws_port"]:
+            threading.Thread(
+                target=serve_websocket, args=(replay, options["ws_port"]), daemon=True
+            ).start()
+            self.stdout.write(f"Streaming prices on port {options['ws_port']}")
+        self.stdout.write(f"Serving prices on port {options['port']}")
+        serve_http(replay, options["port"])
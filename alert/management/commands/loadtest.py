@@ -0,0 +1,166 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from alert.models import Alert, get_slot
+from api import coinapi
+from api.celery import app
+from api.engine import PriceEngine
+from api.prices import SNAPSHOT_KEY, read_snapshot, refresh_snapshot
+from api.settings import BASE_URL
+from api.store import get_redis
+from api.tasks import check_alerts
+from user.models import User
+
+PREFIX = "loadtest-"
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds users and alerts, runs alert checks against the prices served "
+        "by coinapi_stub and reports the triggers per second, the trigger "
+        "latency and the upstream calls per check. It needs a dedicated "
+        "database and redis instance: every active alert gets checked."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--alerts", type=int, default=10000)
+        parser.add_argument("--ticks", type=int, default=10)
+        parser.add_argument(
+            "--interval", type=float, default=1.0, help="Seconds between checks"
+        )
+        parser.add_argument(
+            "--evolution-share",
+            type=float,
+            default=0.2,
+            help="Share of evolution alerts among the seeded alerts",
+        )
+        parser.add_argument(
+            "--spread",
+            type=float,
+            default=0.02,
+            help="Maximum relative distance of the thresholds to the current rate",
+        )
+        parser.add_argument(
+            "--keep", action="store_true", help="Keep the seeded users and alerts"
+        )
+
+    def upstream_calls(self):
+        """Returns the number of calls served by coinapi_stub, if it is used"""
+        try:
+            return requests.get(BASE_URL.split("/v1/")[0] + "/stats").json()["calls"]
+        except (requests.exceptions.RequestException, ValueError, KeyError):
+            return None
+
+    def seed(self, users, alerts, evolution_share, spread):
+        snapshot = refresh_snapshot()
+        engine = PriceEngine(snapshot)
+        assets = sorted(snapshot.prices)
+        now = timezone.now()
+        User.objects.bulk_create(
+            [
+                User(username=f"{PREFIX}{number}", email=f"{PREFIX}{number}@host.com")
+                for number in range(users)
+            ]
+        )
+        user_ids = list(
+            User.objects.filter(username__startswith=PREFIX).values_list(
+                "id", flat=True
+            )
+        )
+        seeded = []
+        for _ in range(alerts):
+            base_currency, quote_currency = random.sample(assets, 2)
+            rate = engine.rate(base_currency, quote_currency)
+            alert = Alert(
+                user_id=random.choice(user_ids),
+                base_currency=base_currency,
+                quote_currency=quote_currency,
+                starting_value_in_quote=rate,
+                period_start=now,
+            )
+            if random.random() < evolution_share:
+                alert.evolution_rate = random.choice([-1, 1]) * random.uniform(
+                    0.1, 100 * spread
+                )
+                alert.period = timedelta(minutes=random.randint(5, 60))
+            else:
+                alert.threshold = rate * (1 + random.uniform(-spread, spread))
+            alert.next_check_at = None
+            alert.slot = get_slot(base_currency, quote_currency)
+            seeded.append(alert)
+        Alert.objects.bulk_create(seeded, batch_size=1000)
+
+    def check_environment(self):
+        """
+        Refuses to run against coinapi.io (its quota is bypassed) or a
+        database holding real alerts (they would be triggered too)
+        """
+        if self.upstream_calls() is None:
+            raise CommandError(
+                "COINAPI_URL must point at a running coinapi_stub, see README.md"
+            )
+        if (
+            Alert.objects.filter(is_active=True)
+            .exclude(user__username__startswith=PREFIX)
+            .exists()
+        ):
+            raise CommandError(
+                "The database holds active alerts of real users, "
+                "run the load test against a dedicated database"
+            )
+
+    def handle(self, *args, **options):
+        settings.EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
+        app.conf.task_always_eager = True
+        self.check_environment()
+        self.seed(
+            options["users"],
+            options["alerts"],
+            options["evolution_share"],
+            options["spread"],
+        )
+        seeded = Alert.objects.filter(user__username__startswith=PREFIX)
+        durations, latencies, triggers, calls = [], [], 0, []
+        try:
+            for _ in range(options["ticks"]):
+                time.sleep(options["interval"])
+                # Every check refreshes the prices from the stub, which has no quota
+                get_redis().delete(SNAPSHOT_KEY, coinapi.QUOTA_KEY)
+                calls_before = self.upstream_calls()
+                active_before = seeded.filter(is_active=True).count()
+                started = time.perf_counter()
+                check_alerts()
+                durations.append(time.perf_counter() - started)
+                latencies.append(time.time() - read_snapshot().fetched_at)
+                triggers += active_before - seeded.filter(is_active=True).count()
+                if calls_before is not None:
+                    calls.append(self.upstream_calls() - calls_before)
+        finally:
+            if not options["keep"]:
+                User.objects.filter(username__startswith=PREFIX).delete()
+        if not durations:
+            return
+        self.stdout.write(f"checks:              {len(durations)}")
+        self.stdout.write(f"triggers:            {triggers}")
+        self.stdout.write(f"triggers/s:          {triggers / sum(durations):.1f}")
+        self.stdout.write(
+            f"check duration (s):  mean {statistics.mean(durations):.3f} "
+            f"max {max(durations):.3f}"
+        )
+        self.stdout.write(
+            f"trigger latency (s): mean {statistics.mean(latencies):.3f} "
+            f"max {max(latencies):.3f}"
+        )
+        if calls:
+            self.stdout.write(f"upstream calls/check: {statistics.mean(calls):.2f}")
+        metrics = coinapi.get_metrics()
+        self.stdout.write(
+            f"upstream latency (s): mean {metrics['average_latency']:.3f} "
+            f"over {metrics.get('calls', 0):.0f} calls"
+        )
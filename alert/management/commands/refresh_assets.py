@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from alert.assets import refresh_assets
+
+
+class Command(BaseCommand):
+    help = "Downloads the catalogue of supported assets from coinapi.io"
+
+    def handle(self, *args, **options):
+        count = refresh_assets()
+        self.stdout.write(self.style.SUCCESS(f"{count} assets stored"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from api.settings import STREAM_CHECK_INTERVAL
+from api.stream import PriceStream
+from api.tasks import check_alerts
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams the exchange rates of the assets used by the active alerts "
+        "from coinapi.io and checks the alerts as soon as they move"
+    )
+
+    def check_alerts(self):
+        """Checks still queued after a few updates are dropped by the workers"""
+        check_alerts.apply_async(expires=5 * STREAM_CHECK_INTERVAL)
+
+    def handle(self, *args, **options):
+        self.stdout.write("Streaming prices from coinapi.io")
+        PriceStream(on_update=self.check_alerts).run()
@@ -0,0 +1,70 @@
+from datetime import timedelta
+from django.utils import timezone
+from api.settings import (
+    ALERT_INDEX_REBUILD_INTERVAL,
+    ALERT_INDEX_SYNC_MARGIN,
+    ALERT_SHARDS,
+)
+from .models import ALERT_SLOTS, Alert
+
+
+def get_shard_slots(shard):
+    """Returns the slots (see Alert.slot) of a shard"""
+    return [slot for slot in range(ALERT_SLOTS) if slot % ALERT_SHARDS == shard]
+
+
+class AlertMirror:
+    """
+    Base class of the in memory structures mirroring some of the active
+    alerts. They are rebuilt from the database every
+    ALERT_INDEX_REBUILD_INTERVAL seconds and kept up to date in between with
+    the alerts modified since the last sync. The sync window overlaps the
+    previous one by ALERT_INDEX_SYNC_MARGIN to catch rows committed late,
+    reloading a row twice being harmless.
+
+    Subclasses define the mirrored fields (starting with "id" and ending with
+    "is_active"), the filter selecting their alerts and how rows are loaded.
+    A mirror given a shard only loads the alerts of this shard, and drops
+    the ones moved to another shard.
+    """
+
+    fields = ()
+    filters = {}
+
+    def __init__(self, shard=None):
+        self.shard = shard
+        self.built_at = None
+        self.synced_at = None
+        self.reset()
+
+    def reset(self):
+        raise NotImplementedError
+
+    def load(self, rows):
+        raise NotImplementedError
+
+    def discard(self, alert_id):
+        raise NotImplementedError
+
+    def sync(self):
+        now = timezone.now()
+        alerts = Alert.objects.filter(**self.filters)
+        rebuild = self.built_at is None or now - self.built_at > timedelta(
+            seconds=ALERT_INDEX_REBUILD_INTERVAL
+        )
+        if rebuild:
+            self.reset()
+            alerts = alerts.filter(is_active=True)
+            self.built_at = now
+        else:
+            since = self.synced_at - timedelta(seconds=ALERT_INDEX_SYNC_MARGIN)
+            alerts = alerts.filter(modified__gte=since)
+        if self.shard is not None:
+            slots = get_shard_slots(self.shard)
+            if not rebuild:
+                moved = alerts.exclude(slot__in=slots).values_list("id", flat=True)
+                for alert_id in moved.iterator():
+                    self.discard(alert_id)
+            alerts = alerts.filter(slot__in=slots)
+        self.load(alerts.values_list(*self.fields).iterator())
+        self.synced_at = now
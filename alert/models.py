@@ -1,28 +1,62 @@
+import zlib
 from django.conf import settings
+from django.contrib.postgres.indexes import BrinIndex
 from django.db import models
-from api.settings import BASE_URL, HEADERS
-import requests
+from django.utils import timezone
 
+# Alerts are spread over ALERT_SLOTS slots by pair, the shards of the checker
+# being sets of slots, so changing the number of shards moves no alert
 
-def get_asset_list():
+ALERT_SLOTS = 1024
+
+
+def get_slot(base_currency, quote_currency):
+    """Returns the slot of a pair, the same in every process"""
+    return zlib.crc32(f"{base_currency}/{quote_currency}".encode()) % ALERT_SLOTS
+
+
+class Asset(models.Model):
     """
-    This function returns the list of all assets where a USD exchange rate
-    is provided by the coinapi.io API
-    The user can pick any two currencies from this list to create his alerts
+    Local copy of the coinapi.io assets providing a USD exchange rate,
+    refreshed in the background by the refresh_assets task
     """
-    asset_list = []
-    response = requests.get(url=BASE_URL + "assets", headers=HEADERS)
-    try:
-        response.raise_for_status()
-        for asset in response.json():
-            if "price_usd" in asset:
-                asset_list.append(asset["asset_id"])
-    except requests.exceptions.HTTPError as e:
-        raise e
-    return asset_list
 
+    asset_id = models.CharField(max_length=10, primary_key=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ("asset_id",)
 
-ASSET_LIST = get_asset_list()
+    def __str__(self):
+        return self.asset_id
+
+
+class PriceSample(models.Model):
+    """
+    USD price of an asset at a given time. Samples are appended in time order
+    (hence the BRIN index) and older ones are downsampled, their resolution
+    being the length in seconds of the period they average (0 for raw ones)
+    """
+
+    asset_id = models.CharField(max_length=10)
+    time = models.DateTimeField()
+    price = models.FloatField()
+    resolution = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ("time",)
+        indexes = [
+            BrinIndex(fields=["time"], name="price_sample_time_brin"),
+            models.Index(fields=["asset_id", "time"], name="price_sample_asset_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["asset_id", "time", "resolution"], name="unique_price_sample"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.asset_id} {self.price} USD at {self.time}"
 
 
 class Alert(models.Model):
@@ -36,7 +70,8 @@ class Alert(models.Model):
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="alerts"
     )
     created = models.DateTimeField(auto_now_add=True)
-    period_start = models.DateTimeField(auto_now=True)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+    period_start = models.DateTimeField(default=timezone.now)
     base_currency = models.CharField(max_length=10)
     quote_currency = models.CharField(max_length=10)
     threshold = models.DecimalField(
@@ -50,9 +85,25 @@ class Alert(models.Model):
         max_digits=38, decimal_places=9, null=True, blank=True
     )
     is_active = models.BooleanField(default=True)
+    triggered_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    slot = models.PositiveSmallIntegerField(default=0)
+    next_check_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ("created",)
+        indexes = [
+            models.Index(fields=["is_active", "next_check_at"], name="alert_due_idx"),
+            models.Index(
+                fields=["base_currency", "quote_currency"],
+                condition=models.Q(is_active=True),
+                name="alert_active_pair_idx",
+            ),
+            models.Index(
+                fields=["slot"],
+                condition=models.Q(is_active=True),
+                name="alert_active_slot_idx",
+            ),
+        ]
 
     def __str__(self):
         if self.threshold:
@@ -69,6 +120,22 @@ class Alert(models.Model):
             )
         return content
 
+    def save(self, *args, **kwargs):
+        self.slot = get_slot(self.base_currency, self.quote_currency)
+        super().save(*args, **kwargs)
+
+    def get_next_check_at(self):
+        """
+        Returns when the checker has to come back to this alert: right away
+        while its starting value is pending, never afterwards (the alert is
+        then watched by the threshold index or the evolution table on every
+        tick, until a far threshold alert is moved to the slow lane by
+        alert.lanes)
+        """
+        if self.starting_value_in_quote is None:
+            return timezone.now()
+        return None
+
     @property
     def is_upper_bound(self):
         """
@@ -77,6 +144,10 @@ class Alert(models.Model):
         """
         if self.evolution_rate and self.evolution_rate >= 0:
             return True
-        if self.threshold and self.threshold >= self.starting_value_in_quote:
+        if (
+            self.threshold
+            and self.starting_value_in_quote is not None
+            and self.threshold >= self.starting_value_in_quote
+        ):
             return True
         return False
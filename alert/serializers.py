@@ -1,8 +1,11 @@
 from rest_framework import serializers
 from datetime import timedelta
-from api.tasks import check_prices, update_rate_values, get_starting_rate
+from django.utils import timezone
+from api.tasks import get_starting_rate, set_starting_rate
 from user.models import User
-from .models import Alert, ASSET_LIST
+from .assets import get_asset_ids
+from .models import Alert
+from .timers import schedule_alert
 
 
 class AlertSerializer(serializers.ModelSerializer):
@@ -26,9 +29,18 @@ class AlertSerializer(serializers.ModelSerializer):
     class Meta:
         model = Alert
         fields = "__all__"
-        read_only_fields = ["id", "created", "user"]
+        read_only_fields = [
+            "id",
+            "created",
+            "modified",
+            "user",
+            "period_start",
+            "next_check_at",
+            "triggered_at",
+            "slot",
+        ]
 
-    def create(self, validated_data, response):
+    def create(self, validated_data):
         """
         The user attached to the alert is grabbed from the route used to create it
         Regular users can only access their alerts on /alerts route whereas a
@@ -43,40 +55,42 @@ class AlertSerializer(serializers.ModelSerializer):
             user = request.user
         if "quote_currency" not in validated_data:
             validated_data["quote_currency"] = "USD"
-        update_rate_values(
-            validated_data["base_currency"], validated_data["quote_currency"], response
-        )
         validated_data["starting_value_in_quote"] = get_starting_rate(validated_data)
-        alert = Alert.objects.create(user=user, **validated_data)
-        check_prices.apply_async((alert.id,))
+        alert = Alert(user=user, **validated_data)
+        alert.next_check_at = alert.get_next_check_at()
         alert.save()
+        schedule_alert(alert)
+        if alert.starting_value_in_quote is None:
+            set_starting_rate.apply_async((alert.id,))
         return alert
 
-    def update(self, instance, validated_data, response):
-        update_rate_values(
-            validated_data["base_currency"], validated_data["quote_currency"], response
-        )
+    def update(self, instance, validated_data):
         validated_data["starting_value_in_quote"] = get_starting_rate(validated_data)
-        if instance.is_active is False:
-            check_prices.apply_async((instance.id,))
+        validated_data["period_start"] = timezone.now()
         instance.is_active = True
         instance = super().update(instance, validated_data)
+        instance.next_check_at = instance.get_next_check_at()
         instance.save()
+        schedule_alert(instance)
+        if instance.starting_value_in_quote is None:
+            set_starting_rate.apply_async((instance.id,))
         return instance
 
     def validate_base_currency(self, value):
-        if value not in ASSET_LIST:
+        asset_ids = get_asset_ids()
+        if value not in asset_ids:
             raise serializers.ValidationError(
                 "This base currency is not supported, you must pick one from "
-                + f"the following list: {ASSET_LIST}"
+                + f"the following list: {sorted(asset_ids)}"
             )
         return value
 
     def validate_quote_currency(self, value):
-        if value not in ASSET_LIST:
+        asset_ids = get_asset_ids()
+        if value not in asset_ids:
             raise serializers.ValidationError(
                 "This quote currency is not supported, you must pick one from "
-                + f"the following list: {ASSET_LIST}"
+                + f"the following list: {sorted(asset_ids)}"
             )
         return value
 
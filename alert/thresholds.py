@@ -0,0 +1,139 @@
+from bisect import bisect_left, bisect_right, insort
+from .mirror import AlertMirror
+
+
+class PairThresholds:
+    """
+    Sorted distinct thresholds of the alerts set on a single pair: upper
+    bounds are met when the rate climbs above them, lower bounds when it falls
+    under them. Alerts sharing a threshold and a direction form a single group
+    which is checked once whatever its number of members.
+    """
+
+    def __init__(self):
+        self.upper_bounds = []
+        self.lower_bounds = []
+        self.groups = {}
+
+    def __len__(self):
+        return len(self.groups)
+
+    def bounds(self, is_upper_bound):
+        return self.upper_bounds if is_upper_bound else self.lower_bounds
+
+    def add(self, alert_id, threshold, is_upper_bound):
+        group = (threshold, is_upper_bound)
+        if group not in self.groups:
+            self.groups[group] = set()
+            insort(self.bounds(is_upper_bound), threshold)
+        self.groups[group].add(alert_id)
+
+    def remove(self, alert_id, threshold, is_upper_bound):
+        group = (threshold, is_upper_bound)
+        members = self.groups.get(group)
+        if members is None:
+            return
+        members.discard(alert_id)
+        if not members:
+            del self.groups[group]
+            bounds = self.bounds(is_upper_bound)
+            del bounds[bisect_left(bounds, threshold)]
+
+    def crossed(self, rate):
+        """
+        Returns the ids of the alerts whose threshold is crossed by rate,
+        found by bisection so the cost only depends on how many are crossed
+        """
+        above = bisect_left(self.upper_bounds, rate)
+        under = bisect_right(self.lower_bounds, rate)
+        alert_ids = []
+        for threshold in self.upper_bounds[:above]:
+            alert_ids += self.groups[(threshold, True)]
+        for threshold in self.lower_bounds[under:]:
+            alert_ids += self.groups[(threshold, False)]
+        return alert_ids
+
+
+class ThresholdIndex(AlertMirror):
+    """
+    In memory index of the active threshold alerts of the fast lane, grouped
+    by pair. Alerts scheduled for later (see alert.lanes) are left out.
+    """
+
+    fields = (
+        "id",
+        "base_currency",
+        "quote_currency",
+        "threshold",
+        "starting_value_in_quote",
+        "next_check_at",
+        "is_active",
+    )
+    filters = {"threshold__isnull": False}
+
+    def reset(self):
+        self.reviewed_at = None
+        self.pairs = {}
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, alert_id, base_currency, quote_currency, threshold, starting_value):
+        pair = (base_currency, quote_currency)
+        is_upper_bound = threshold >= starting_value
+        self.pairs.setdefault(pair, PairThresholds()).add(
+            alert_id, threshold, is_upper_bound
+        )
+        self.entries[alert_id] = (pair, threshold, is_upper_bound)
+
+    def discard(self, alert_id):
+        if alert_id not in self.entries:
+            return
+        pair, threshold, is_upper_bound = self.entries.pop(alert_id)
+        self.pairs[pair].remove(alert_id, threshold, is_upper_bound)
+        if not self.pairs[pair]:
+            del self.pairs[pair]
+
+    def load(self, rows):
+        for (
+            alert_id,
+            base_currency,
+            quote_currency,
+            threshold,
+            starting_value,
+            next_check_at,
+            is_active,
+        ) in rows:
+            self.discard(alert_id)
+            if is_active and starting_value is not None and next_check_at is None:
+                self.add(
+                    alert_id,
+                    base_currency,
+                    quote_currency,
+                    float(threshold),
+                    float(starting_value),
+                )
+
+    def triggered(self, engine):
+        """Returns the ids of the alerts whose threshold is met by the rates"""
+        alert_ids = []
+        for pair, thresholds in self.pairs.items():
+            if pair in engine:
+                alert_ids += thresholds.crossed(engine.rate(*pair))
+        return alert_ids
+
+
+_indexes = {}
+
+
+def get_threshold_index(shard=None):
+    """
+    Returns the index of the shard (of all the alerts if None) kept by this
+    process, synced with the database
+    """
+    if shard not in _indexes:
+        _indexes[shard] = ThresholdIndex(shard)
+    index = _indexes[shard]
+    index.sync()
+    return index
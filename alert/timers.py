@@ -0,0 +1,65 @@
+from api.settings import ALERT_DUE_BATCH_SIZE
+from api.store import get_redis
+from .models import Alert
+
+DUE_KEY = "alerts:due"
+
+# Removes and returns at most ARGV[2] members due at ARGV[1], atomically so
+# an alert is popped by a single worker
+POP_DUE_SCRIPT = """
+local due = redis.call("zrangebyscore", KEYS[1], "-inf", ARGV[1], "limit", 0, ARGV[2])
+if #due > 0 then
+    redis.call("zrem", KEYS[1], unpack(due))
+end
+return due
+"""
+
+
+def schedule(due_times):
+    """
+    Sets when the checker has to come back to the alerts, given as a
+    mapping of alert ids to datetimes. The due times are kept in a redis
+    sorted set, so scheduling an alert is O(log n) and no task is queued.
+    """
+    if due_times:
+        get_redis().zadd(
+            DUE_KEY,
+            {
+                alert_id: due_time.timestamp()
+                for alert_id, due_time in due_times.items()
+            },
+        )
+
+
+def unschedule(alert_ids):
+    if alert_ids:
+        get_redis().zrem(DUE_KEY, *alert_ids)
+
+
+def schedule_alert(alert):
+    """Follows Alert.next_check_at, the durable copy of the due time"""
+    if alert.next_check_at is None:
+        unschedule([alert.id])
+    else:
+        schedule({alert.id: alert.next_check_at})
+
+
+def pop_due(now):
+    """Yields the ids of the alerts due at now (a datetime) by batches"""
+    while True:
+        alert_ids = get_redis().eval(
+            POP_DUE_SCRIPT, 1, DUE_KEY, now.timestamp(), ALERT_DUE_BATCH_SIZE
+        )
+        if not alert_ids:
+            return
+        yield [int(alert_id) for alert_id in alert_ids]
+        if len(alert_ids) < ALERT_DUE_BATCH_SIZE:
+            return
+
+
+def reload_schedule():
+    """Refills the sorted set from the database, after redis lost it"""
+    due_times = Alert.objects.filter(
+        is_active=True, next_check_at__isnull=False
+    ).values_list("id", "next_check_at")
+    schedule(dict(due_times))
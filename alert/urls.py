@@ -1,10 +1,17 @@
+from django.urls import path
 from rest_framework import routers
-from .views import AlertViewSet
+from .views import AlertViewSet, PriceHistoryView
 
 app_name = "alert"
 
 router = routers.SimpleRouter(trailing_slash=False)
-router.register("alerts", AlertViewSet, base_name="alerts")
-router.register(r"users/(?P<user>\d+)/alerts", AlertViewSet, base_name="user_alert")
+router.register("alerts", AlertViewSet, basename="alerts")
+router.register(r"users/(?P<user>\d+)/alerts", AlertViewSet, basename="user_alert")
 
-urlpatterns = router.urls
+urlpatterns = [
+    path(
+        "prices/<str:base_currency>/<str:quote_currency>/history",
+        PriceHistoryView.as_view(),
+        name="price_history",
+    )
+] + router.urls
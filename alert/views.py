@@ -1,9 +1,12 @@
-import requests
+from datetime import timedelta
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework import status, viewsets
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
-from api.settings import BASE_URL
+from rest_framework.views import APIView
 from .filters import AdminOrOwnerFilter
+from .history import get_rate_history
 from .models import Alert
 from .serializers import AlertSerializer
 
@@ -26,17 +29,21 @@ class AlertViewSet(viewsets.ModelViewSet):
             return [IsAdminUser()]
         return [IsAuthenticated()]
 
+    def get_write_status(self, alert):
+        """
+        Alerts saved while no fresh price snapshot was cached get their
+        starting rate asynchronously, this is notified with a 202 status
+        """
+        if alert.starting_value_in_quote is None:
+            return status.HTTP_202_ACCEPTED
+        return status.HTTP_200_OK
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        try:
-            response = requests.get(url=BASE_URL + "assets")
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            return Response(data=str(e), status=status.HTTP_400_BAD_REQUEST)
-        alert = serializer.create(request.data, response)
+        alert = serializer.create(request.data)
         request.data["id"] = alert.id
-        return Response(data=request.data, status=status.HTTP_200_OK)
+        return Response(data=request.data, status=self.get_write_status(alert))
 
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop("partial", False)
@@ -48,11 +55,35 @@ class AlertViewSet(viewsets.ModelViewSet):
             request.data["base_currency"] = instance.base_currency
         if "quote_currency" not in request.data:
             request.data["quote_currency"] = instance.quote_currency
+        instance = serializer.update(instance, request.data)
+        request.data["id"] = instance.id
+        return Response(data=request.data, status=self.get_write_status(instance))
+
+
+class PriceHistoryView(APIView):
+    """
+    Recorded exchange rates of a pair, between the start and end query
+    parameters (ISO 8601 datetimes), over the last 24 hours by default
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def get_datetime(self, name, default):
+        value = parse_datetime(self.request.query_params.get(name, ""))
+        if value is None:
+            return default
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+
+    def get(self, request, base_currency, quote_currency):
         try:
-            response = requests.get(url=BASE_URL + "assets")
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
+            end = self.get_datetime("end", timezone.now())
+            start = self.get_datetime("start", end - timedelta(days=1))
+        except ValueError as e:
             return Response(data=str(e), status=status.HTTP_400_BAD_REQUEST)
-        serializer.update(instance, request.data, response)
-        request.data["id"] = instance.id
-        return Response(data=request.data, status=status.HTTP_200_OK)
+        history = get_rate_history(base_currency, quote_currency, start, end)
+        return Response(
+            data=[{"time": time, "rate": rate} for time, rate in history],
+            status=status.HTTP_200_OK,
+        )
@@ -0,0 +1,40 @@
+from collections import deque
+
+
+class RollingWindow:
+    """
+    Minimum and maximum of a rate over a sliding window of length seconds.
+    Samples are kept in two monotonic deques, so each one costs O(1)
+    amortized: a sample only enters and leaves each deque once.
+    """
+
+    def __init__(self, length):
+        self.length = length
+        self.lows = deque()
+        self.highs = deque()
+        self.last = None
+
+    def push(self, time, rate):
+        """Adds the rate sampled at time (a POSIX timestamp)"""
+        if self.last is not None and time <= self.last:
+            return
+        while self.lows and self.lows[-1][1] >= rate:
+            self.lows.pop()
+        self.lows.append((time, rate))
+        while self.highs and self.highs[-1][1] <= rate:
+            self.highs.pop()
+        self.highs.append((time, rate))
+        self.last = time
+        start = time - self.length
+        while self.lows[0][0] < start:
+            self.lows.popleft()
+        while self.highs[0][0] < start:
+            self.highs.popleft()
+
+    @property
+    def low(self):
+        return self.lows[0][1] if self.lows else float("nan")
+
+    @property
+    def high(self):
+        return self.highs[0][1] if self.highs else float("nan")
@@ -0,0 +1,179 @@
+import logging
+import time
+import ijson
+import requests
+from requests.adapters import HTTPAdapter
+from api.settings import (
+    BASE_URL,
+    COINAPI_BREAKER_COOLDOWN,
+    COINAPI_BREAKER_THRESHOLD,
+    COINAPI_BURST,
+    COINAPI_DAILY_LIMIT,
+    COINAPI_POOL_SIZE,
+    COINAPI_TIMEOUT,
+    HEADERS,
+)
+from .store import get_redis
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+QUOTA_KEY = "coinapi:quota"
+BREAKER_FAILURES_KEY = "coinapi:breaker:failures"
+BREAKER_OPEN_KEY = "coinapi:breaker:open"
+METRICS_KEY = "coinapi:metrics"
+
+# Token bucket shared by every process: refills at rate tokens per second up
+# to capacity and takes one token per call if there is one left
+TAKE_TOKEN_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call("hmget", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * rate)
+local taken = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    taken = 1
+end
+redis.call("hset", KEYS[1], "tokens", tokens, "updated", now)
+redis.call("expire", KEYS[1], math.ceil(capacity / rate))
+return taken
+"""
+
+
+class CoinAPIError(requests.exceptions.RequestException):
+    """A call to coinapi.io was not made to protect the quota or the service"""
+
+
+class QuotaExceeded(CoinAPIError):
+    pass
+
+
+class CircuitOpen(CoinAPIError):
+    pass
+
+
+_session = None
+
+
+def get_session():
+    """
+    Returns the session of this process: its connections are kept alive and
+    pooled, and it always sends the API key and accepts compressed bodies
+    """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        _session.headers.update(HEADERS)
+        _session.headers["Accept-Encoding"] = "gzip, deflate"
+        adapter = HTTPAdapter(
+            pool_connections=COINAPI_POOL_SIZE, pool_maxsize=COINAPI_POOL_SIZE
+        )
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    return _session
+
+
+def count(metric, amount=1):
+    get_redis().hincrbyfloat(METRICS_KEY, metric, amount)
+
+
+def get_metrics():
+    """
+    Returns the counters of the calls made, saved (served from the cache or
+    refused by the quota guard and the circuit breaker) and failed, and the
+    average latency of the calls in seconds
+    """
+    metrics = {
+        key.decode(): float(value)
+        for key, value in get_redis().hgetall(METRICS_KEY).items()
+    }
+    calls = metrics.get("calls", 0)
+    metrics["average_latency"] = metrics.get("latency", 0) / calls if calls else 0
+    return metrics
+
+
+def take_token():
+    return get_redis().eval(
+        TAKE_TOKEN_SCRIPT,
+        1,
+        QUOTA_KEY,
+        COINAPI_BURST,
+        COINAPI_DAILY_LIMIT / (24 * 60 * 60),
+        time.time(),
+    )
+
+
+def record_failure():
+    client = get_redis()
+    failures = client.incr(BREAKER_FAILURES_KEY)
+    client.expire(BREAKER_FAILURES_KEY, COINAPI_BREAKER_COOLDOWN)
+    count("failures")
+    if failures >= COINAPI_BREAKER_THRESHOLD:
+        client.set(BREAKER_OPEN_KEY, 1, ex=COINAPI_BREAKER_COOLDOWN)
+        client.delete(BREAKER_FAILURES_KEY)
+        logger.warning("coinapi.io circuit opened for %ss", COINAPI_BREAKER_COOLDOWN)
+
+
+def get(path, params=None, stream=False):
+    """
+    GETs path from the coinapi.io REST API through the pooled session, with
+    timeouts. The call is refused when the daily quota would be exceeded
+    (token bucket of COINAPI_BURST tokens refilled to COINAPI_DAILY_LIMIT per
+    day) or when the circuit is open: COINAPI_BREAKER_THRESHOLD consecutive
+    failures open it for COINAPI_BREAKER_COOLDOWN seconds.
+    """
+    if get_redis().exists(BREAKER_OPEN_KEY):
+        count("saved_by_breaker")
+        raise CircuitOpen("coinapi.io is failing, calls are suspended")
+    if not take_token():
+        count("saved_by_quota")
+        raise QuotaExceeded("The coinapi.io daily quota would be exceeded")
+    started = time.perf_counter()
+    try:
+        response = get_session().get(
+            BASE_URL + path, params=params, timeout=COINAPI_TIMEOUT, stream=stream
+        )
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        response = getattr(e, "response", None)
+        if response is None or response.status_code >= 500:
+            record_failure()
+        raise
+    finally:
+        count("calls")
+        count("latency", time.perf_counter() - started)
+    get_redis().delete(BREAKER_FAILURES_KEY)
+    return response
+
+
+def read_prices(events, asset):
+    """Yields the prices of the assets whose parsing events ended in events"""
+    for prefix, event, value in events:
+        if prefix in ("item.asset_id", "item.price_usd"):
+            asset[prefix] = value
+        elif prefix == "item" and event == "end_map":
+            if len(asset) == 2:
+                yield asset["item.asset_id"], asset["item.price_usd"]
+            asset.clear()
+    del events[:]
+
+
+def iter_prices(response):
+    """
+    Yields the (asset_id, price_usd) pairs of an assets response, skipping
+    the assets without a USD price. The body is parsed as it is downloaded
+    so the whole list is never held in memory.
+    """
+    events = ijson.sendable_list()
+    parser = ijson.parse_coro(events, use_float=True)
+    asset = {}
+    for chunk in response.iter_content(CHUNK_SIZE):
+        parser.send(chunk)
+        yield from read_prices(events, asset)
+    parser.close()
+    yield from read_prices(events, asset)
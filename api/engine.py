@@ -0,0 +1,49 @@
+import numpy as np
+
+
+class PriceEngine:
+    """
+    Cross rates of a price snapshot for a set of pairs, computed in a single
+    vectorized division. Every rate is a float64: Decimal values are only
+    used when rates are stored in database.
+    """
+
+    def __init__(self, snapshot, pairs=()):
+        self.snapshot = snapshot
+        self.pairs = [
+            (base_currency, quote_currency)
+            for base_currency, quote_currency in set(pairs)
+            if base_currency in snapshot and quote_currency in snapshot
+        ]
+        self.pair_index = {pair: position for position, pair in enumerate(self.pairs)}
+        self.assets = sorted({asset_id for pair in self.pairs for asset_id in pair})
+        asset_index = {
+            asset_id: position for position, asset_id in enumerate(self.assets)
+        }
+        prices = np.array(
+            [snapshot.prices[asset_id] for asset_id in self.assets], float
+        )
+        bases = np.array([asset_index[base] for base, _ in self.pairs], np.int64)
+        quotes = np.array([asset_index[quote] for _, quote in self.pairs], np.int64)
+        self.rates = prices[bases] / prices[quotes]
+
+    def __contains__(self, pair):
+        base_currency, quote_currency = pair
+        return base_currency in self.snapshot and quote_currency in self.snapshot
+
+    def rate(self, base_currency, quote_currency):
+        """Returns the rate of base_currency expressed in quote_currency"""
+        position = self.pair_index.get((base_currency, quote_currency))
+        if position is not None:
+            return float(self.rates[position])
+        return float(self.snapshot.prices[base_currency]) / float(
+            self.snapshot.prices[quote_currency]
+        )
+
+    def rates_of(self, pairs):
+        """Returns the array of the rates of pairs, NaN for the pairs not computed"""
+        missing = len(self.pairs)
+        positions = np.array(
+            [self.pair_index.get(pair, missing) for pair in pairs], np.int64
+        )
+        return np.append(self.rates, np.nan)[positions]
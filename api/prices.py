@@ -0,0 +1,128 @@
+import json
+import time
+import requests
+from alert.assets import get_alert_assets
+from api.settings import (
+    PRICE_REFRESH_TIMEOUT,
+    PRICE_SNAPSHOT_MAX_AGE,
+    PRICE_SNAPSHOT_TTL,
+)
+from . import coinapi
+from .store import get_redis, hold_lock
+
+SNAPSHOT_KEY = "prices:snapshot"
+REFRESH_LOCK_KEY = "prices:snapshot:lock"
+
+
+class PriceSnapshot:
+    """
+    USD prices of the assets provided by coinapi.io along with the
+    timestamp they were stored at and the one each price was fetched at
+    (all the same when they come from a single download)
+    """
+
+    def __init__(self, prices, fetched_at, times=None):
+        self.prices = prices
+        self.fetched_at = fetched_at
+        if times is None:
+            times = dict.fromkeys(prices, fetched_at)
+        self.times = times
+
+    def __contains__(self, asset_id):
+        return asset_id in self.prices
+
+    @property
+    def age(self):
+        """Age of the oldest price"""
+        return time.time() - min(self.times.values(), default=self.fetched_at)
+
+    def dumps(self):
+        return json.dumps(
+            {"prices": self.prices, "fetched_at": self.fetched_at, "times": self.times}
+        )
+
+    @classmethod
+    def loads(cls, raw):
+        data = json.loads(raw)
+        return cls(data["prices"], data["fetched_at"], data.get("times"))
+
+
+def fetch_snapshot(assets=None):
+    """
+    Downloads the USD price of the given assets from coinapi.io, or of every
+    asset if assets is None
+    """
+    params = None
+    if assets is not None:
+        assets = frozenset(assets)
+        if not assets:
+            return PriceSnapshot({}, time.time())
+        params = {"filter_asset_id": ";".join(sorted(assets))}
+    with coinapi.get("assets", params=params, stream=True) as response:
+        prices = {
+            asset_id: price
+            for asset_id, price in coinapi.iter_prices(response)
+            if assets is None or asset_id in assets
+        }
+    return PriceSnapshot(prices, time.time())
+
+
+def read_snapshot():
+    """Returns the shared snapshot, or None if there is none in the cache"""
+    raw = get_redis().get(SNAPSHOT_KEY)
+    if raw is None:
+        return None
+    return PriceSnapshot.loads(raw)
+
+
+def store_snapshot(snapshot):
+    get_redis().set(SNAPSHOT_KEY, snapshot.dumps(), ex=PRICE_SNAPSHOT_TTL)
+
+
+def get_snapshot(max_age=PRICE_SNAPSHOT_MAX_AGE, assets=()):
+    """
+    Returns the shared snapshot if it is younger than max_age seconds and
+    has the price of the given assets, otherwise refreshes it first with the
+    assets of the active alerts. When the coinapi client refuses the call to
+    protect the quota or the failing service, the cached snapshot is used
+    until it expires.
+    """
+    snapshot = read_snapshot()
+    if (
+        snapshot is not None
+        and snapshot.age <= max_age
+        and all(asset_id in snapshot for asset_id in assets)
+    ):
+        coinapi.count("saved_by_cache")
+        return snapshot
+    try:
+        return refresh_snapshot(get_alert_assets() | frozenset(assets))
+    except coinapi.CoinAPIError:
+        if snapshot is None:
+            raise
+        return snapshot
+
+
+def refresh_snapshot(assets=None):
+    """
+    Single flight refresh of the shared snapshot with the prices of the given
+    assets (all of them if None): only the caller holding the redis lock hits
+    coinapi.io, the others wait for its result and take over the lock in turn
+    if it fails
+    """
+    started = time.time()
+    deadline = started + PRICE_REFRESH_TIMEOUT
+    while True:
+        with hold_lock(REFRESH_LOCK_KEY, PRICE_REFRESH_TIMEOUT) as locked:
+            if locked:
+                snapshot = fetch_snapshot(assets)
+                store_snapshot(snapshot)
+                return snapshot
+        time.sleep(0.1)
+        snapshot = read_snapshot()
+        if snapshot is not None and snapshot.fetched_at >= started:
+            return snapshot
+        if time.time() >= deadline:
+            raise requests.exceptions.Timeout(
+                "Timed out waiting for the price snapshot to be refreshed"
+            )
@@ -135,18 +135,150 @@ USE_TZ = True
 
 STATIC_URL = "/static/"
 
+# Primary keys keep the type they had before Django 3.2
+
+DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
+
 
 # Config for CELERY
 
-CELERY_BROKER_URL = "redis://localhost"
+REDIS_URL = "redis://localhost"
+
+CELERY_BROKER_URL = REDIS_URL
 CELERY_TIMEZONE = "UTC"
 
+# Every active alert is checked against a single price snapshot per tick
+
+ALERT_CHECK_INTERVAL = 60
+
+# The active alerts are split into ALERT_SHARDS shards by currency pair,
+# every tick checks each shard in its own task (so the checks spread over
+# the celery workers) and a shard is never checked by two workers at once.
+# The task of a shard goes to its own queue (ALERT_SHARD_QUEUE) so a single
+# worker process keeps its alerts in memory from tick to tick
+
+ALERT_SHARDS = int(os.environ.get("ALERT_SHARDS", 4))
+ALERT_SHARD_QUEUE = "alerts.shard.{}"
+
+# Alerts needing the checker at a given time (see Alert.get_next_check_at)
+# wait in a redis sorted set and are popped by batches of
+# ALERT_DUE_BATCH_SIZE when due
+
+ALERT_DUE_BATCH_SIZE = 1000
+
+# Threshold alerts more than ALERT_LANE_SIGMAS standard deviations of their
+# pair's rate (estimated over the last ALERT_VOLATILITY_WINDOW seconds of
+# history) away from their threshold leave the per tick checks and are
+# scheduled for when they could reach it, ALERT_SLOW_LANE_MAX_DELAY seconds
+# later at most. The lanes are reviewed every ALERT_LANE_REVIEW_INTERVAL
+
+ALERT_LANE_SIGMAS = 4
+ALERT_VOLATILITY_WINDOW = 24 * 60 * 60
+ALERT_LANE_REVIEW_INTERVAL = 10 * 60
+ALERT_SLOW_LANE_MAX_DELAY = 60 * 60
+
+# The catalogue of supported assets is downloaded every
+# ASSET_LIST_REFRESH_INTERVAL seconds and stored in database, processes
+# reload it from there every ASSET_LIST_RELOAD_INTERVAL seconds
+
+ASSET_LIST_REFRESH_INTERVAL = 24 * 60 * 60
+ASSET_LIST_RELOAD_INTERVAL = 10 * 60
+
+# Assets missing from a downloaded catalogue are only deleted if it holds at
+# least ASSET_LIST_MIN_SHARE of the stored one, so an empty or truncated
+# answer of coinapi.io can't wipe it
+
+ASSET_LIST_MIN_SHARE = 0.5
+
+# Workers keep the active alerts indexed in memory, the indexes are fully
+# rebuilt every ALERT_INDEX_REBUILD_INTERVAL seconds and otherwise only
+# reload the alerts modified since their last sync (minus a safety margin)
+
+ALERT_INDEX_REBUILD_INTERVAL = 60 * 60
+ALERT_INDEX_SYNC_MARGIN = 60
+
+# The prices of the assets used by the alerts are recorded at most every
+# PRICE_HISTORY_INTERVAL seconds, raw samples older than
+# PRICE_HISTORY_RAW_RETENTION seconds are averaged by PRICE_HISTORY_DOWNSAMPLING
+# ("minute", "hour" or "day") and all samples are deleted after
+# PRICE_HISTORY_RETENTION seconds
+
+PRICE_HISTORY_INTERVAL = ALERT_CHECK_INTERVAL
+PRICE_HISTORY_RAW_RETENTION = 2 * 24 * 60 * 60
+PRICE_HISTORY_DOWNSAMPLING = "hour"
+PRICE_HISTORY_RETENTION = 90 * 24 * 60 * 60
+
+CELERY_BEAT_SCHEDULE = {
+    "check-alerts": {
+        "task": "api.tasks.check_alerts",
+        "schedule": ALERT_CHECK_INTERVAL,
+    },
+    "refresh-asset-list": {
+        "task": "api.tasks.refresh_asset_list",
+        "schedule": ASSET_LIST_REFRESH_INTERVAL,
+    },
+    "compact-price-history": {
+        "task": "api.tasks.compact_price_history",
+        "schedule": 24 * 60 * 60,
+    },
+    "send-due-digests": {
+        "task": "api.tasks.send_due_digests",
+        "schedule": ALERT_CHECK_INTERVAL,
+    },
+}
+
 
 # Coinapi.io API config
 
-BASE_URL = f"https://rest.coinapi.io/v1/"
+# COINAPI_URL and COINAPI_WS_URL can point to the coinapi_stub command
+
+BASE_URL = os.environ.get("COINAPI_URL", "https://rest.coinapi.io/v1/")
 HEADERS = {"X-CoinAPI-Key": "REPLACE_ME"}
 
+# Calls to coinapi.io share a pool of COINAPI_POOL_SIZE connections per
+# process and time out after COINAPI_TIMEOUT (connect, read) seconds. They are
+# limited to COINAPI_DAILY_LIMIT per day by a token bucket holding up to
+# COINAPI_BURST calls, and suspended for COINAPI_BREAKER_COOLDOWN seconds after
+# COINAPI_BREAKER_THRESHOLD consecutive failures
+
+COINAPI_POOL_SIZE = 10
+COINAPI_TIMEOUT = (3.05, 30)
+COINAPI_DAILY_LIMIT = 100
+COINAPI_BURST = 5
+COINAPI_BREAKER_THRESHOLD = 5
+COINAPI_BREAKER_COOLDOWN = 60
+
+# Once the burst is spent, the quota allows a call every COINAPI_CALL_INTERVAL
+# seconds
+
+COINAPI_CALL_INTERVAL = 24 * 60 * 60 / COINAPI_DAILY_LIMIT
+
+# Price snapshots are shared between processes through redis (REDIS_URL).
+# They expire after PRICE_SNAPSHOT_TTL seconds and are refreshed when older
+# than PRICE_SNAPSHOT_MAX_AGE seconds, PRICE_REFRESH_TIMEOUT bounds the time
+# spent waiting for another process to refresh them. A snapshot outlives the
+# calls refused by the quota, so the alerts are checked against it meanwhile
+
+PRICE_SNAPSHOT_TTL = int(max(10 * 60, 2 * COINAPI_CALL_INTERVAL))
+PRICE_SNAPSHOT_MAX_AGE = ALERT_CHECK_INTERVAL // 2
+PRICE_REFRESH_TIMEOUT = 30
+
+# The stream_prices command merges the streamed rates into the snapshot and
+# checks the alerts every STREAM_CHECK_INTERVAL seconds, it follows the
+# assets used by the alerts every STREAM_RESUBSCRIBE_INTERVAL seconds
+
+WS_URL = os.environ.get("COINAPI_WS_URL", "wss://ws.coinapi.io/v1/")
+STREAM_CHECK_INTERVAL = 1
+STREAM_RESUBSCRIBE_INTERVAL = 60
+
+# Alert writes only use a cached snapshot younger than this many seconds
+# (the longest a snapshot can wait for the quota to refresh it), otherwise
+# the starting rate of the alert is set asynchronously
+
+ALERT_RATE_MAX_STALENESS = int(
+    max(5 * 60, PRICE_SNAPSHOT_MAX_AGE + COINAPI_CALL_INTERVAL)
+)
+
 
 # SMTP config to send mails
 
@@ -158,3 +290,24 @@ EMAIL_HOST_PASSWORD = "REPLACE_ME"
 EMAIL_PORT = 587
 
 DEFAULT_FROM_EMAIL = "REPLACE_ME"
+
+# Triggered alerts are emailed by batches sharing a single SMTP connection
+
+EMAIL_BATCH_SIZE = 100
+
+# Each trigger is notified once: a notification is claimed for
+# NOTIFICATION_CLAIM_TIMEOUT seconds while it is being sent and remembered
+# NOTIFICATION_KEY_TTL seconds once sent. Every NOTIFICATION_SWEEP_INTERVAL
+# seconds, the triggers of the last NOTIFICATION_SWEEP_WINDOW seconds that
+# are neither notified nor claimed (their claim expired with a dead worker,
+# or their email was never queued) are queued again
+
+NOTIFICATION_CLAIM_TIMEOUT = 10 * 60
+NOTIFICATION_KEY_TTL = 7 * 24 * 60 * 60
+NOTIFICATION_SWEEP_INTERVAL = 5 * 60
+NOTIFICATION_SWEEP_WINDOW = 24 * 60 * 60
+
+CELERY_BEAT_SCHEDULE["sweep-notifications"] = {
+    "task": "api.tasks.sweep_notifications",
+    "schedule": NOTIFICATION_SWEEP_INTERVAL,
+}
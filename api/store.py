@@ -0,0 +1,42 @@
+import uuid
+from contextlib import contextmanager
+import redis
+from api.settings import REDIS_URL
+
+_client = None
+
+# Deletes the lock only if it is still held by the caller
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def get_redis():
+    """
+    Returns a client on the redis instance shared by the web and celery
+    workers (the one celery already uses as a broker)
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(REDIS_URL)
+    return _client
+
+
+@contextmanager
+def hold_lock(key, timeout):
+    """
+    Tries to take the lock key, held for timeout seconds at most, and yields
+    whether it was taken. It is released on exit unless it expired and was
+    taken by someone else in the meantime.
+    """
+    client = get_redis()
+    token = uuid.uuid4().hex
+    locked = client.set(key, token, nx=True, ex=timeout)
+    try:
+        yield locked
+    finally:
+        if locked:
+            client.eval(RELEASE_LOCK_SCRIPT, 1, key, token)
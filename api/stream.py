@@ -0,0 +1,130 @@
+import json
+import logging
+import threading
+import time
+import websocket
+from alert.assets import get_alert_assets
+from api.settings import (
+    HEADERS,
+    STREAM_CHECK_INTERVAL,
+    STREAM_RESUBSCRIBE_INTERVAL,
+    WS_URL,
+)
+from .prices import PriceSnapshot, read_snapshot, store_snapshot
+
+logger = logging.getLogger(__name__)
+
+QUOTE_ASSET = "USD"
+
+
+class PriceStream:
+    """
+    Subscribes to the coinapi.io exchange rate stream of the assets used by
+    the active alerts. Every STREAM_CHECK_INTERVAL seconds the received rates
+    are merged into the shared price snapshot and, if some of them changed,
+    the alerts are checked against it right away. The subscription follows
+    the assets of the alerts every STREAM_RESUBSCRIBE_INTERVAL seconds.
+    """
+
+    def __init__(self, on_update):
+        self.on_update = on_update
+        self.prices = {QUOTE_ASSET: 1.0}
+        self.times = {QUOTE_ASSET: time.time()}
+        self.assets = frozenset()
+        self.changed = False
+        self.lock = threading.Lock()
+        self.app = None
+
+    def hello(self):
+        return json.dumps(
+            {
+                "type": "hello",
+                "apikey": HEADERS["X-CoinAPI-Key"],
+                "heartbeat": False,
+                "subscribe_data_type": ["exrate"],
+                "subscribe_filter_asset_id": [
+                    f"{asset_id}/{QUOTE_ASSET}"
+                    for asset_id in sorted(self.assets)
+                    if asset_id != QUOTE_ASSET
+                ],
+            }
+        )
+
+    def subscribe(self):
+        self.assets = get_alert_assets()
+        with self.lock:
+            for asset_id in set(self.prices) - self.assets - {QUOTE_ASSET}:
+                del self.prices[asset_id]
+                del self.times[asset_id]
+        if self.app is not None and self.app.sock is not None:
+            self.app.send(self.hello())
+
+    def on_open(self):
+        self.app.send(self.hello())
+
+    def on_message(self, message):
+        data = json.loads(message)
+        if data.get("type") != "exrate" or data.get("asset_id_quote") != QUOTE_ASSET:
+            return
+        with self.lock:
+            self.prices[data["asset_id_base"]] = data["rate"]
+            self.times[data["asset_id_base"]] = time.time()
+            self.changed = True
+
+    def on_error(self, error):
+        logger.warning("Price stream error: %s", error)
+
+    def publish(self):
+        """
+        Merges the streamed prices newer than the ones of the shared snapshot
+        into it. The other prices keep their own timestamp, so the snapshot
+        gets stale (and is refreshed from the REST API) when some of its
+        assets are not streamed.
+        """
+        now = time.time()
+        with self.lock:
+            if not self.changed:
+                return False
+            self.times[QUOTE_ASSET] = now
+            streamed = dict(self.prices)
+            streamed_times = dict(self.times)
+            self.changed = False
+        snapshot = read_snapshot()
+        prices = dict(snapshot.prices) if snapshot is not None else {}
+        times = dict(snapshot.times) if snapshot is not None else {}
+        for asset_id, price in streamed.items():
+            if streamed_times[asset_id] > times.get(asset_id, 0):
+                prices[asset_id] = price
+                times[asset_id] = streamed_times[asset_id]
+        store_snapshot(PriceSnapshot(prices, now, times))
+        return True
+
+    def publish_forever(self):
+        subscribed_at = time.time()
+        while True:
+            time.sleep(STREAM_CHECK_INTERVAL)
+            if time.time() - subscribed_at > STREAM_RESUBSCRIBE_INTERVAL:
+                self.subscribe()
+                subscribed_at = time.time()
+            if self.publish():
+                self.on_update()
+
+    def run(self):
+        """Streams forever, reconnecting with an increasing delay"""
+        self.assets = get_alert_assets()
+        threading.Thread(target=self.publish_forever, daemon=True).start()
+        delay = 1
+        while True:
+            self.app = websocket.WebSocketApp(
+                WS_URL,
+                on_open=self.on_open,
+                on_message=self.on_message,
+                on_error=self.on_error,
+            )
+            started = time.time()
+            self.app.run_forever()
+            if time.time() - started > STREAM_RESUBSCRIBE_INTERVAL:
+                delay = 1
+            logger.warning("Price stream closed, reconnecting in %ss", delay)
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
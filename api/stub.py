@@ -0,0 +1,200 @@
+import base64
+import hashlib
+import json
+import math
+import random
+import socket
+import struct
+import threading
+import time
+from bisect import bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+WS_MAGIC = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class PriceReplay:
+    """
+    Price series replayed at speed times the real pace. Recorded series are
+    read from a JSON lines file of {"time": <seconds>, "prices": {...}} frames
+    and replayed in a loop, otherwise assets random walk every second of
+    replay time.
+    """
+
+    def __init__(self, path=None, assets=50, speed=1.0, volatility=0.01, seed=None):
+        self.speed = speed
+        self.volatility = volatility
+        self.random = random.Random(seed)
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.frames = []
+        if path:
+            with open(path) as recording:
+                self.frames = [json.loads(line) for line in recording if line.strip()]
+            self.times = [frame["time"] for frame in self.frames]
+        else:
+            self.step = 0
+            self.current = {"USD": 1.0}
+            for number in range(assets):
+                self.current[f"A{number:03d}"] = 10 ** self.random.uniform(-2, 4)
+
+    def elapsed(self):
+        return (time.time() - self.started) * self.speed
+
+    def prices(self):
+        """Returns the USD prices at the current replay time"""
+        if self.frames:
+            duration = self.times[-1] - self.times[0] + 1
+            moment = self.times[0] + self.elapsed() % duration
+            return self.frames[bisect_right(self.times, moment) - 1]["prices"]
+        with self.lock:
+            while self.step < int(self.elapsed()):
+                self.step += 1
+                for asset_id in self.current:
+                    if asset_id != "USD":
+                        self.current[asset_id] *= math.exp(
+                            self.random.gauss(0, self.volatility)
+                        )
+            return dict(self.current)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves /v1/assets like coinapi.io does, and the call count on /stats"""
+
+    def send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            return self.send_json({"calls": self.server.calls})
+        if url.path.rstrip("/") != "/v1/assets":
+            return self.send_error(404)
+        self.server.calls += 1
+        prices = self.server.replay.prices()
+        wanted = parse_qs(url.query).get("filter_asset_id")
+        if wanted:
+            wanted = set(wanted[0].replace(",", ";").split(";"))
+            prices = {key: value for key, value in prices.items() if key in wanted}
+        self.send_json(
+            [
+                {"asset_id": asset_id, "name": asset_id, "price_usd": price}
+                for asset_id, price in prices.items()
+            ]
+        )
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_http(replay, port):
+    server = ThreadingHTTPServer(("", port), StubHandler)
+    server.replay = replay
+    server.calls = 0
+    server.serve_forever()
+
+
+def read_frame(connection):
+    """
+    Reads a (masked) text frame sent by a websocket client, None once the
+    client closed the connection
+    """
+    header = connection.recv(2)
+    if len(header) < 2 or header[0] & 0x0F == 0x8:
+        return None
+    length = header[1] & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", connection.recv(2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", connection.recv(8))[0]
+    mask = connection.recv(4) if header[1] & 0x80 else b"\0\0\0\0"
+    payload = b""
+    while len(payload) < length:
+        chunk = connection.recv(length - len(payload))
+        if not chunk:
+            return None
+        payload += chunk
+    return bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload)).decode()
+
+
+def send_frame(connection, text):
+    payload = text.encode()
+    if len(payload) < 126:
+        header = struct.pack(">BB", 0x81, len(payload))
+    elif len(payload) < 1 << 16:
+        header = struct.pack(">BBH", 0x81, 126, len(payload))
+    else:
+        header = struct.pack(">BBQ", 0x81, 127, len(payload))
+    connection.sendall(header + payload)
+
+
+def follow_hellos(connection, subscription):
+    """
+    Reads the hello messages of a client until it disconnects, each one
+    replacing the subscribed assets
+    """
+    while True:
+        try:
+            frame = read_frame(connection)
+            if frame is None:
+                return
+            hello = json.loads(frame)
+        except (OSError, ValueError):
+            return
+        subscription["assets"] = frozenset(
+            pair.split("/")[0] for pair in hello.get("subscribe_filter_asset_id", [])
+        )
+
+
+def stream_client(connection, replay):
+    """
+    Answers the websocket handshake, then pushes an exrate message for each
+    asset of the last subscription every second of replay time
+    """
+    request = connection.recv(4096).decode()
+    key = next(
+        line.split(":", 1)[1].strip()
+        for line in request.split("\r\n")
+        if line.lower().startswith("sec-websocket-key")
+    )
+    accept = base64.b64encode(hashlib.sha1((key + WS_MAGIC).encode()).digest())
+    connection.sendall(
+        b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+        b"Connection: Upgrade\r\nSec-WebSocket-Accept: " + accept + b"\r\n\r\n"
+    )
+    subscription = {"assets": frozenset()}
+    threading.Thread(
+        target=follow_hellos, args=(connection, subscription), daemon=True
+    ).start()
+    try:
+        while True:
+            prices = replay.prices()
+            for asset_id in subscription["assets"] & set(prices):
+                message = {
+                    "type": "exrate",
+                    "asset_id_base": asset_id,
+                    "asset_id_quote": "USD",
+                    "rate": prices[asset_id],
+                }
+                send_frame(connection, json.dumps(message))
+            time.sleep(1 / replay.speed)
+    except OSError:
+        connection.close()
+
+
+def serve_websocket(replay, port):
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("", port))
+    server.listen()
+    while True:
+        connection, _ = server.accept()
+        threading.Thread(
+            target=stream_client, args=(connection, replay), daemon=True
+        ).start()
@@ -1,15 +1,48 @@
 from __future__ import absolute_import, unicode_literals
+import logging
+import time
+from datetime import timedelta
+from functools import lru_cache
 import requests
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import get_template
 from django.utils import timezone
 from smtplib import SMTPException
-from celery import shared_task
+from celery import group, shared_task
+from celery.signals import worker_ready
 from .celery import app
-from alert.models import Alert
-from api.settings import BASE_URL, DEFAULT_FROM_EMAIL
+from alert.assets import refresh_assets
+from alert.changes import AlertChanges
+from alert.models import Alert, Asset
+from alert.evolution import get_evolution_table
+from alert.history import compact_history, record_snapshot
+from alert.lanes import check_slow_lane_alert, review_lanes
+from alert.thresholds import get_threshold_index
+from alert.timers import pop_due, reload_schedule, schedule, unschedule
+from api.settings import (
+    ALERT_CHECK_INTERVAL,
+    ALERT_INDEX_REBUILD_INTERVAL,
+    ALERT_RATE_MAX_STALENESS,
+    ALERT_SHARDS,
+    ALERT_SHARD_QUEUE,
+    DEFAULT_FROM_EMAIL,
+    EMAIL_BATCH_SIZE,
+    NOTIFICATION_CLAIM_TIMEOUT,
+    NOTIFICATION_KEY_TTL,
+    NOTIFICATION_SWEEP_WINDOW,
+)
+from .engine import PriceEngine
+from .prices import get_snapshot, read_snapshot
+from .store import get_redis, hold_lock
 
-RATE_VALUES = {}
+logger = logging.getLogger(__name__)
+
+DIGEST_KEY = "digest:{}"
+DIGEST_DUE_KEY = "digest:due"
+RECOVERY_LOCK_KEY = "alerts:recovery:lock"
+SCHEDULE_RELOAD_KEY = "alerts:due:reloaded"
+SHARD_LOCK_KEY = "alerts:shard:{}:lock"
+NOTIFICATION_KEY = "notification:{}:{}"
 
 
 def get_alert_message(alert):
@@ -32,125 +65,391 @@ def get_alert_message(alert):
     return msg
 
 
+@lru_cache(maxsize=None)
+def get_email_templates():
+    """Compiles the email templates once per process"""
+    return get_template("template.txt"), get_template("template_inline.html")
+
+
+def get_email_message(user, title, text, html_text, connection=None):
+    text_template, html_template = get_email_templates()
+    message = EmailMultiAlternatives(
+        subject="New alert",
+        body=text_template.render({"title": title, "text": text}),
+        from_email=DEFAULT_FROM_EMAIL,
+        to=[user.email],
+        connection=connection,
+    )
+    message.attach_alternative(
+        html_template.render({"title": title, "text": html_text}), "text/html"
+    )
+    return message
+
+
+def get_alert_email(alert, connection=None):
+    text = get_alert_message(alert)
+    return get_email_message(
+        alert.user,
+        f"New alert:{alert.base_currency}/{alert.quote_currency}",
+        text,
+        text,
+        connection,
+    )
+
+
+def get_digest_email(user, alerts):
+    """Merges the messages of several alerts of a user into a single email"""
+    messages = [get_alert_message(alert) for alert in alerts]
+    return get_email_message(
+        user,
+        f"{len(alerts)} new alerts",
+        "\n\n".join(messages),
+        "<br>".join(messages),
+    )
+
+
+def get_notification_key(alert):
+    """Idempotency key of the notification of the last trigger of the alert"""
+    return NOTIFICATION_KEY.format(alert.id, alert.triggered_at.timestamp())
+
+
+def claim_notification(alert):
+    """
+    Returns whether the caller may notify the last trigger of the alert, i.e.
+    it was neither notified nor being notified
+    """
+    return get_redis().set(
+        get_notification_key(alert), "sending", nx=True, ex=NOTIFICATION_CLAIM_TIMEOUT
+    )
+
+
+def confirm_notification(alert):
+    get_redis().set(get_notification_key(alert), "sent", ex=NOTIFICATION_KEY_TTL)
+
+
+def release_notification(alert):
+    get_redis().delete(get_notification_key(alert))
+
+
+def queue_digest(alert):
+    """
+    Adds the alert to the pending digest of its user, the first alert of a
+    coalescing window sets the digest due at the end of this window
+    """
+    client = get_redis()
+    if client.rpush(DIGEST_KEY.format(alert.user_id), alert.id) == 1:
+        due = time.time() + alert.user.digest_window.total_seconds()
+        client.zadd(DIGEST_DUE_KEY, {alert.user_id: due}, nx=True)
+
+
+@shared_task
+def send_due_digests():
+    """
+    Periodic task (see CELERY_BEAT_SCHEDULE) sending the digests whose
+    coalescing window is over. Their due times are kept in redis instead of
+    countdown tasks, so they survive the restarts of the workers.
+    """
+    client = get_redis()
+    for user_id in client.zrangebyscore(DIGEST_DUE_KEY, "-inf", time.time()):
+        if client.zrem(DIGEST_DUE_KEY, user_id):
+            send_digest.apply_async((int(user_id),))
+
+
 @app.task(bind=True, default_retry_delay=10 * 60)
-def send_email_alert(self, alert_id):
+def send_digest(self, user_id, alert_ids=None):
+    """
+    Sends a single email for all the alerts of a user triggered during his
+    coalescing window and retries every 10 minutes in case it fails.
+    """
+    if alert_ids is None:
+        key = DIGEST_KEY.format(user_id)
+        pipeline = get_redis().pipeline()
+        pipeline.lrange(key, 0, -1)
+        pipeline.delete(key)
+        alert_ids = [int(alert_id) for alert_id in pipeline.execute()[0]]
+    alerts = list(Alert.objects.filter(id__in=alert_ids).select_related("user"))
+    if not alerts:
+        return
+    try:
+        get_digest_email(alerts[0].user, alerts).send()
+    except (SMTPException, OSError) as ex:
+        self.retry(args=(user_id, alert_ids), exc=ex)
+
+
+@app.task(
+    bind=True, default_retry_delay=10 * 60, acks_late=True, reject_on_worker_lost=True
+)
+def send_email_alerts(self, alert_ids):
     """
-    Sends an email to user letting him know one of his alerts
-    just met his criteria and retries every 10 minutes in case
-    if fails.
+    Sends an email to the users of a batch of alerts that just met their
+    criteria, through a single SMTP connection, and retries every 10
+    minutes for the emails that could not be sent. Alerts of users in
+    digest mode are queued for their digest instead. Every trigger is
+    claimed first, so duplicated batches and retries never notify it twice,
+    and the claims of the triggers left unnotified are released whatever
+    happens. The batch is only acknowledged once done, so it is delivered
+    again if its worker dies.
     """
-    alert = Alert.objects.get(id=alert_id)
+    started = time.perf_counter()
+    alerts = Alert.objects.filter(
+        id__in=alert_ids, is_active=False, triggered_at__isnull=False
+    ).select_related("user")
+    claimed = {}
+    sent = 0
     try:
-        context = {
-            "title": f"New alert:{alert.base_currency}/{alert.quote_currency}",
-            "text": get_alert_message(alert),
-        }
-        message = render_to_string("template.txt", context)
-        html_message = render_to_string("template_inline.html", context)
-        send_mail(
-            subject="New alert",
-            message=message,
-            from_email=DEFAULT_FROM_EMAIL,
-            recipient_list=[alert.user.email],
-            fail_silently=False,
-            html_message=html_message,
+        for alert in alerts:
+            if not claim_notification(alert):
+                continue
+            claimed[alert.id] = alert
+            if alert.user.digest_window:
+                queue_digest(alert)
+                confirm_notification(alert)
+                del claimed[alert.id]
+        with get_connection(fail_silently=False) as connection:
+            for alert_id, alert in list(claimed.items()):
+                get_alert_email(alert, connection).send()
+                confirm_notification(alert)
+                del claimed[alert_id]
+                sent += 1
+    except (SMTPException, OSError) as ex:
+        self.retry(args=(list(claimed),), exc=ex)
+    finally:
+        for alert in claimed.values():
+            release_notification(alert)
+        duration = time.perf_counter() - started
+        logger.info(
+            "Sent %s alert emails in %.2fs (%.1f/s)",
+            sent,
+            duration,
+            sent / duration if duration else 0,
         )
-    except SMTPException as ex:
-        self.retry(exc=ex)
 
 
-def get_starting_rate(validated_data):
-    """ Returns the rate on alert creation"""
-    return (
-        RATE_VALUES[validated_data["base_currency"]]
-        / RATE_VALUES[validated_data["quote_currency"]]
+@shared_task
+def sweep_notifications():
+    """
+    Periodic task (see CELERY_BEAT_SCHEDULE) queuing again the emails of the
+    alerts triggered during the last NOTIFICATION_SWEEP_WINDOW seconds that
+    are neither notified nor being notified, e.g. because their checker died
+    between writing the trigger and queuing its email. Alerts triggered
+    during the last tick are left to their checker.
+    """
+    now = timezone.now()
+    triggered = list(
+        Alert.objects.filter(
+            is_active=False,
+            triggered_at__gte=now - timedelta(seconds=NOTIFICATION_SWEEP_WINDOW),
+            triggered_at__lte=now - timedelta(seconds=ALERT_CHECK_INTERVAL),
+        ).only("id", "triggered_at")
     )
+    pipeline = get_redis().pipeline()
+    for alert in triggered:
+        pipeline.exists(get_notification_key(alert))
+    notified = pipeline.execute()
+    missing = [alert.id for alert, done in zip(triggered, notified) if not done]
+    if missing:
+        logger.warning("Queuing again the emails of %s alerts", len(missing))
+    queue_alert_emails(missing)
 
 
-def update_rate_values(base_currency, quote_currency, response):
-    """ Stores the rates of every active alert currency"""
-    for asset in response.json():
-        if asset["asset_id"] in [base_currency, quote_currency]:
-            RATE_VALUES[asset["asset_id"]] = asset["price_usd"]
+def get_starting_rate(validated_data):
+    """
+    Returns the rate on alert creation from the cached snapshot without
+    calling coinapi.io, or None if this snapshot is older than
+    ALERT_RATE_MAX_STALENESS: the rate is then set by set_starting_rate
+    """
+    base_currency = validated_data["base_currency"]
+    quote_currency = validated_data["quote_currency"]
+    snapshot = read_snapshot()
+    if (
+        snapshot is None
+        or snapshot.age > ALERT_RATE_MAX_STALENESS
+        or base_currency not in snapshot
+        or quote_currency not in snapshot
+    ):
+        return None
+    return PriceEngine(snapshot).rate(base_currency, quote_currency)
 
 
-def threshold_is_met(alert):
+@app.task(bind=True, default_retry_delay=30)
+def set_starting_rate(self, alert_id):
     """
-    Returns True if an exchange rate met its defined threshold or evolved more
-    than the provided evolution rate within a rolling window of length period.
-    Else, in case of a period-type alert, the period_start attribute of alert
-    is incremented
+    Sets the starting rate of an alert saved while no fresh snapshot was
+    cached, alerts still pending at the next check_alerts tick get it there
     """
-    base_quote_rate = (
-        RATE_VALUES[alert.base_currency] / RATE_VALUES[alert.quote_currency]
+    alert = Alert.objects.filter(
+        id=alert_id, is_active=True, starting_value_in_quote__isnull=True
+    ).first()
+    if alert is None:
+        return
+    try:
+        snapshot = get_snapshot(assets=(alert.base_currency, alert.quote_currency))
+    except requests.exceptions.RequestException as ex:
+        self.retry(exc=ex)
+    if (alert.base_currency, alert.quote_currency) not in PriceEngine(snapshot):
+        self.retry()
+    now = timezone.now()
+    Alert.objects.filter(id=alert_id, starting_value_in_quote__isnull=True).update(
+        starting_value_in_quote=PriceEngine(snapshot).rate(
+            alert.base_currency, alert.quote_currency
+        ),
+        period_start=now,
+        next_check_at=None,
+        modified=now,
     )
-    if alert.is_upper_bound:
-        if (
-            alert.period
-            and timezone.now() < alert.period_start + alert.period
-            and base_quote_rate
-            > alert.starting_value_in_quote * (1 + (alert.evolution_rate / 100))
-        ):
-            return True
-        if not alert.period and base_quote_rate > alert.threshold:
-            return True
-    else:
-        if (
-            alert.period
-            and timezone.now() < alert.period_start + alert.period
-            and base_quote_rate
-            <= alert.starting_value_in_quote * (1 + (alert.evolution_rate / 100))
-        ):
-            return True
-        if not alert.period and base_quote_rate < alert.threshold:
-            return True
-    if alert.period and timezone.now() >= alert.period_start + alert.period:
-        alert.period_start = timezone.now()
-        alert.starting_value_in_quote = (
-            RATE_VALUES[alert.base_currency] / RATE_VALUES[alert.quote_currency]
-        )
-    alert.save()
-    return False
+    unschedule([alert_id])
 
 
-@shared_task
-def check_prices(alert_id):
-    """Task attached to an alert object that frequently checks
-    if the exchange rate hasn't met its boundary
-    """
-    if Alert.objects.filter(id=alert_id, is_active=True):
-        alert = Alert.objects.get(id=alert_id)
-        update_prices(alert.base_currency, alert.quote_currency)
-        if threshold_is_met(alert):
-            send_email_alert.apply_async((alert.id,))
-            alert.is_active = False
-            alert.save()
+def check_due_batch(alert_ids, engine, changes, now):
+    """
+    Sets the pending starting values and checks the slow lane threshold
+    alerts (see alert.lanes) of a batch of due alerts. Alerts whose rate is
+    not available yet are scheduled again for the next tick, the others are
+    not scheduled anymore.
+    """
+    due = Alert.objects.filter(
+        id__in=alert_ids, is_active=True, next_check_at__isnull=False
+    ).values_list(
+        "id", "base_currency", "quote_currency", "threshold", "starting_value_in_quote"
+    )
+    for alert_id, base_currency, quote_currency, threshold, starting_value in due:
+        pair = (base_currency, quote_currency)
+        if pair not in engine:
+            changes.schedule([alert_id], now + timedelta(seconds=ALERT_CHECK_INTERVAL))
+        elif starting_value is None:
+            changes.start_window(alert_id, engine.rate(*pair), now, None)
+        elif threshold is not None:
+            check_slow_lane_alert(
+                alert_id,
+                pair,
+                float(threshold),
+                float(starting_value),
+                engine,
+                changes,
+                now,
+            )
         else:
-            if alert.period:
-                check_prices.apply_async(
-                    (alert_id,), countdown=alert.period.total_seconds()
-                )
-            else:
-                check_prices.apply_async((alert_id,), countdown=60)
+            changes.schedule([alert_id], None)
+
+
+def check_due_alerts(engine, now):
+    """
+    Pops the alerts due for a check (see Alert.get_next_check_at) from the
+    schedule by batches and checks them. The changes are written at the end
+    and the ids of the triggered alerts returned, the popped alerts going
+    back to the schedule if anything fails before.
+    """
+    changes = AlertChanges()
+    popped = []
+    try:
+        for alert_ids in pop_due(now):
+            popped += alert_ids
+            check_due_batch(alert_ids, engine, changes, now)
+        return changes.flush()
+    except Exception:
+        schedule(dict.fromkeys(popped, now))
+        raise
+
 
+def queue_alert_emails(alert_ids):
+    """Queues the emails of triggered alerts by batches of EMAIL_BATCH_SIZE"""
+    for start in range(0, len(alert_ids), EMAIL_BATCH_SIZE):
+        send_email_alerts.apply_async((alert_ids[start : start + EMAIL_BATCH_SIZE],))
 
-def update_prices(base_currency, quote_currency):
-    response = requests.get(url=BASE_URL + "assets")
+
+@shared_task
+def check_alerts():
+    """
+    Periodic task (see CELERY_BEAT_SCHEDULE) that takes the shared price
+    snapshot once per tick, checks the alerts due (see check_due_alerts) and
+    fans the checks of the others out to one check_shard task per shard,
+    sent to the queue of the shard and dropped if not started before the
+    next tick. The schedule of the due alerts is
+    refilled from the database as often as the indexes are rebuilt.
+    """
+    if not Alert.objects.filter(is_active=True).exists():
+        return
     try:
-        response.raise_for_status()
-        update_rate_values(base_currency, quote_currency, response)
-    except requests.exceptions.RequestException as e:
-        return e
+        snapshot = get_snapshot()
+    except requests.exceptions.RequestException:
+        return
+    record_snapshot(snapshot, snapshot.prices)
+    if get_redis().set(
+        SCHEDULE_RELOAD_KEY, 1, nx=True, ex=ALERT_INDEX_REBUILD_INTERVAL
+    ):
+        reload_schedule()
+    queue_alert_emails(check_due_alerts(PriceEngine(snapshot), timezone.now()))
+    group(
+        check_shard.s(shard).set(
+            queue=ALERT_SHARD_QUEUE.format(shard), expires=ALERT_CHECK_INTERVAL
+        )
+        for shard in range(ALERT_SHARDS)
+    ).apply_async()
+
+
+@shared_task(ignore_result=True)
+def check_shard(shard):
+    """
+    Checks the alerts of a shard against the shared snapshot: the rates of
+    all their pairs are computed at once, threshold alerts are looked up in
+    the threshold index so only the met ones are visited and evolution
+    alerts are all checked at once by the evolution table. Both evaluate
+    identical alerts once as a group. State changes are written in bulk and
+    the triggered alerts are notified right away, whatever happens to the
+    other shards. Threshold alerts far from their threshold are moved to the
+    slow lane (see alert.lanes). A shard already being checked by another
+    worker is skipped.
+    """
+    with hold_lock(SHARD_LOCK_KEY.format(shard), ALERT_CHECK_INTERVAL) as locked:
+        snapshot = read_snapshot()
+        if not locked or snapshot is None:
+            return
+        now = timezone.now()
+        index = get_threshold_index(shard)
+        table = get_evolution_table(shard)
+        engine = PriceEngine(snapshot, set(index.pairs) | set(table.pairs))
+        changes = AlertChanges()
+        triggered = index.triggered(engine)
+        for alert_id in triggered:
+            index.discard(alert_id)
+        changes.deactivate(triggered)
+        changes.deactivate(table.evaluate(engine, now.timestamp()))
+        review_lanes(index, engine, changes, now)
+        queue_alert_emails(changes.flush())
 
 
 @shared_task
-def relaunch_tasks():
+def compact_price_history():
+    """Applies the retention policy of the price history (see CELERY_BEAT_SCHEDULE)"""
+    compact_history()
+
+
+@app.task(bind=True, default_retry_delay=10 * 60)
+def refresh_asset_list(self):
+    """Downloads the catalogue of supported assets (see CELERY_BEAT_SCHEDULE)"""
+    try:
+        refresh_assets()
+    except requests.exceptions.RequestException as ex:
+        self.retry(exc=ex)
+
+
+@worker_ready.connect
+def recover(sender, **kwargs):
     """
-    Task that reactivates tasks for every alert, in case the server went down
-    (or in development environment)
+    Catches up after a restart with a single check and digest run for all
+    the workers starting together. Nothing is queued per alert: the state of
+    the alerts lives in the database (see Alert.get_next_check_at) and the
+    due digests in redis. The schedule of the alerts is refilled from the
+    database in case redis lost it.
     """
-    for alert in Alert.objects.filter(is_active=True):
-        check_prices.apply_async((alert.id,), concurrency=1)
+    if get_redis().set(RECOVERY_LOCK_KEY, 1, nx=True, ex=ALERT_CHECK_INTERVAL):
+        reload_schedule()
+        check_alerts.apply_async()
+        send_due_digests.apply_async()
 
 
-relaunch_tasks.apply_async(concurrency=1)
+@worker_ready.connect
+def load_asset_list(sender, **kwargs):
+    """Fills the catalogue of supported assets on the first worker start"""
+    if not Asset.objects.exists():
+        refresh_asset_list.apply_async()
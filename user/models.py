@@ -40,6 +40,7 @@ class User(AbstractUser):
     objects = UserManager()
     email = models.EmailField(max_length=60)
     username = models.CharField(max_length=30, unique=True)
+    digest_window = models.DurationField(null=True, blank=True)
     REQUIRED_FIELDS = ["email"]
 
     def __str__(self):
@@ -1,3 +1,4 @@
+from datetime import timedelta
 from rest_framework import serializers
 from user.models import User
 
@@ -6,7 +7,9 @@ class UserSerializer(serializers.ModelSerializer):
     """
     Quite generic user serializer, the only added thing is
     the confirm_password field that requires the user to enter
-    his password twice and both passwords to match before account creation
+    his password twice and both passwords to match before account creation.
+    Setting a digest_window (in seconds) merges the alerts triggered within
+    this window into a single email.
     """
 
     confirm_password = serializers.CharField(
@@ -15,7 +18,14 @@ class UserSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = User
-        fields = ["id", "email", "username", "password", "confirm_password"]
+        fields = [
+            "id",
+            "email",
+            "username",
+            "password",
+            "confirm_password",
+            "digest_window",
+        ]
         extra_kwargs = {"password": {"write_only": True}}
 
     def create(self, validated_data):
@@ -29,3 +39,10 @@ class UserSerializer(serializers.ModelSerializer):
         user.set_password(password)
         user.save()
         return user
+
+    def validate_digest_window(self, value):
+        if value is not None and value <= timedelta(0):
+            raise serializers.ValidationError(
+                "The digest window must be a positive duration expressed in seconds"
+            )
+        return value